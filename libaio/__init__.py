@@ -19,16 +19,27 @@ pythonic wrapper for libaio
 With minimal eventfd support to make possible to integrate with usual polling
 mechanisms already available in select module.
 """
-from __future__ import absolute_import
-from ctypes import addressof, byref, cast, c_char, c_void_p, pointer
+from ctypes import (
+    addressof, byref, cast, c_char, c_int32, c_uint, c_uint32, c_void_p,
+    memmove, pointer, sizeof,
+)
 import errno
+from functools import partial
+from itertools import islice
+from bisect import bisect_right
 from mmap import mmap
 import os
-from struct import pack, unpack
-import sys
+import platform
+from struct import Struct, pack_into
+from time import monotonic
 from . import libaio
-from .eventfd import eventfd, EFD_CLOEXEC, EFD_NONBLOCK, EFD_SEMAPHORE
+from . import io_uring
+from .eventfd import (
+    eventfd, eventfd_read, eventfd_write,
+    EFD_CLOEXEC, EFD_NONBLOCK, EFD_SEMAPHORE,
+)
 from . import linux_fs
+from . import mman
 from . import ioprio
 # pylint: disable=wildcard-import
 from .linux_fs import *
@@ -37,23 +48,102 @@ from .ioprio import *
 from . import _version
 __version__ = _version.get_versions()['version']
 
-if sys.version_info[0] == 2:
-    # pylint: disable=redefined-builtin, undefined-variable
-    range = xrange
-    # pylint: enable=redefined-builtin, undefined-variable
-
 __all__ = (
     'EFD_CLOEXEC', 'EFD_NONBLOCK', 'EFD_SEMAPHORE',
-    'EventFD', 'AIOBlock', 'AIOContext',
+    'EventFD', 'AIOBlock', 'AIOBlockPool', 'AIOContext', 'IOUringContext',
+    'Context', 'CONTEXT_CLASS_DICT', 'getContextClass',
     'AIOBLOCK_MODE_READ', 'AIOBLOCK_MODE_WRITE',
     'AIOBLOCK_MODE_FSYNC', 'AIOBLOCK_MODE_FDSYNC',
     'AIOBLOCK_MODE_POLL',
 ) + linux_fs.__all__ + ioprio.__all__
 
-class EventFD(object):
+# Leading io_uring_sqe fields, up to buf_index. The others are left to zero.
+_packSQE = Struct('=BBHiqQIIQH').pack_into
+_SQE_SIZE = sizeof(io_uring.io_uring_sqe)
+# Block opcodes accepted by IOUringContext when polling for completions.
+_IOPOLL_OPCODE_SET = frozenset((
+    libaio.IO_CMD_PREAD, libaio.IO_CMD_PWRITE,
+    libaio.IO_CMD_PREADV, libaio.IO_CMD_PWRITEV,
+))
+
+def _getIOCBStruct():
+    # iocb layout depends on the platform: derive the format from ctypes.
+    iocb = libaio.iocb
+    common = libaio.io_iocb_common
+    common_offset = iocb.u.offset
+    struct_format = '='
+    position = 0
+    for offset, size, signed in (
+        (iocb.aio_rw_flags.offset, iocb.aio_rw_flags.size, False),
+        (iocb.aio_lio_opcode.offset, iocb.aio_lio_opcode.size, True),
+        (iocb.aio_reqprio.offset, iocb.aio_reqprio.size, True),
+        (iocb.aio_fildes.offset, iocb.aio_fildes.size, True),
+        (common_offset + common.buf.offset, common.buf.size, False),
+        (common_offset + common.nbytes.offset, common.nbytes.size, False),
+        (common_offset + common.offset.offset, common.offset.size, True),
+        (common_offset + common.flags.offset, common.flags.size, False),
+    ):
+        struct_format += '%ix%s' % (
+            offset - position,
+            {2: 'h', 4: 'i', 8: 'q'}[size] if signed else
+            {2: 'H', 4: 'I', 8: 'Q'}[size],
+        )
+        position = offset + size
+    return Struct(struct_format)
+# Returns: aio_rw_flags, aio_lio_opcode, aio_reqprio, aio_fildes, u.c.buf,
+# u.c.nbytes, u.c.offset, u.c.flags
+_unpackIOCB = _getIOCBStruct().unpack_from
+del _getIOCBStruct
+def _getEventStruct(event_type, *field_list):
+    # Event layout depends on the platform: derive the format from ctypes.
+    struct_format = '='
+    position = 0
+    for name, signed in field_list:
+        field = getattr(event_type, name)
+        struct_format += '%ix%s' % (
+            field.offset - position,
+            {4: 'i', 8: 'q'}[field.size] if signed else
+            {4: 'I', 8: 'Q'}[field.size],
+        )
+        position = field.offset + field.size
+    return Struct(struct_format + '%ix' % (sizeof(event_type) - position))
+
+def _getEventWordIndexList(event_type, *field_name_list):
+    result = []
+    for name in field_name_list:
+        field = getattr(event_type, name)
+        if field.size != 8 or field.offset % 8:
+            return None
+        result.append(field.offset // 8)
+    return result
+
+# getEventsInto rows: block id, res, res2
+_EVENT_ROW_SIZE = 3 * 8
+
+# u.c.offset, accessed without going through the nested ctypes structures.
+_IOCB_OFFSET_OFFSET = (
+    libaio.iocb.u.offset + libaio.io_iocb_common.offset.offset
+)
+_IOCB_OFFSET_STRUCT = Struct('=q')
+_packIOCBOffset = _IOCB_OFFSET_STRUCT.pack_into
+_unpackIOCBOffset = _IOCB_OFFSET_STRUCT.unpack_from
+
+# Sharing rings with the kernel without a syscall requires loads and stores to
+# not be reordered with others of the same kind, which python cannot enforce:
+# only do it on architectures guaranteeing it.
+_ORDERED_MEMORY_ACCESS = platform.machine() in (
+    'x86_64', 'i386', 'i486', 'i586', 'i686',
+)
+# io_uring syscall numbers are the asm-generic ones, which these
+# architectures do not use.
+_IO_URING_SYSCALLS = not platform.machine().startswith(('alpha', 'mips'))
+
+class EventFD:
     """
     Minimal file-like object for eventfd.
     """
+    _fd = None
+
     def __init__(self, initval=0, flags=0):
         """
         initval (int 0..2**64 - 1)
@@ -61,7 +151,9 @@ class EventFD(object):
         flags (int)
             Bit mask of EFD_* constants.
         """
-        self._file = os.fdopen(eventfd(initval, flags), 'r+b', 0)
+        # Not wrapped in a python file object: eventfd is always accessed 8
+        # bytes at a time, so buffering and locking would be pure overhead.
+        self._fd = eventfd(initval, flags)
 
     def __enter__(self):
         """
@@ -75,11 +167,20 @@ class EventFD(object):
         """
         self.close()
 
+    def __del__(self):
+        """
+        Calls close, in case instance was not properly closed by the time it
+        gets garbage-collected.
+        """
+        self.close()
+
     def close(self):
         """
         Close file.
         """
-        self._file.close()
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
 
     def read(self):
         """
@@ -87,22 +188,24 @@ class EventFD(object):
 
         See manpage for flags effect on this.
         """
-        result = self._file.read(8)
-        if result:
-            return unpack('Q', result)[0]
-        return None
+        try:
+            return eventfd_read(self._fd)
+        except OSError as exc:
+            if exc.errno != errno.EAGAIN:
+                raise
+            return None
 
     def write(self, value):
         """
         Add given value to counter.
         """
-        self._file.write(pack('Q', value))
+        eventfd_write(self._fd, value)
 
     def fileno(self):
         """
         Return eventfd's file descriptor.
         """
-        return self._file.fileno()
+        return self._fd
 
 AIOBLOCK_MODE_READ = object()
 AIOBLOCK_MODE_WRITE = object()
@@ -110,7 +213,7 @@ AIOBLOCK_MODE_FSYNC = object()
 AIOBLOCK_MODE_FDSYNC = object()
 AIOBLOCK_MODE_POLL = object()
 
-class AIOBlock(object):
+class AIOBlock:
     """
     Asynchronous I/O block.
 
@@ -128,11 +231,22 @@ class AIOBlock(object):
         y: x for x, y in _AIOBLOCK_MODE_DICT.items()
     }
     assert len(_AIOBLOCK_MODE_DICT) == len(_REVERSE_AIOBLOCK_MODE_DICT)
-    _buffer_list = None
-    _eventfd = None
-    _file = None
-    _iovec = None
-    _onCompletion = None
+    # Single-buffer blocks use the non-vectored opcodes, sparing the kernel
+    # an iovec copy.
+    _SINGLE_BUFFER_OPCODE_DICT = {
+        libaio.IO_CMD_PREADV: libaio.IO_CMD_PREAD,
+        libaio.IO_CMD_PWRITEV: libaio.IO_CMD_PWRITE,
+    }
+    _VECTOR_OPCODE_DICT = {
+        y: x for x, y in _SINGLE_BUFFER_OPCODE_DICT.items()
+    }
+    _REVERSE_AIOBLOCK_MODE_DICT[libaio.IO_CMD_PREAD] = AIOBLOCK_MODE_READ
+    _REVERSE_AIOBLOCK_MODE_DICT[libaio.IO_CMD_PWRITE] = AIOBLOCK_MODE_WRITE
+    # No per-instance dict: blocks may be allocated by the thousand.
+    __slots__ = (
+        '_iocb', '_iocb_p', '_iocb_address', '_buffer_list', '_eventfd',
+        '_file', '_iovec', '_onCompletion', '__weakref__',
+    )
 
     def __init__(
         self,
@@ -147,6 +261,7 @@ class AIOBlock(object):
         rw_flags=0,
         io_priority=None,
         event_mask=0,
+        iocb=None,
     ):
         """
         mode (AIOBLOCK_MODE_*)
@@ -181,19 +296,40 @@ class AIOBlock(object):
         event_mask (int)
             OR-ed select.EPOLL* constants. EPOLLERR and EPOLLHUP are always
             enabled.
+        iocb (libaio.iocb, None)
+            For internal use. A zero-filled iocb to use instead of allocating
+            one, so AIOBlockPool can allocate all its iocbs at once.
         """
-        self._iocb = iocb = libaio.iocb()
-        libaio.zero(iocb)
+        # ctypes zero-fills new structures, which is the default value of all
+        # fields: only call setters for non-default values.
+        if iocb is None:
+            iocb = libaio.iocb()
+        self._iocb = iocb
+        self._iocb_p = pointer(iocb)
+        self._iocb_address = addressof(iocb)
+        # Identifies this block in AIOContext, and comes back in io_event.data
+        # on completion.
+        iocb.data = id(self)
+        self._iovec = None
+        self._buffer_list = None
+        self._eventfd = None
+        self._file = None
         self.mode = mode
-        self.target_file = target_file
-        self.io_priority = io_priority
+        if target_file is not None:
+            self.target_file = target_file
+        if io_priority is not None:
+            self.io_priority = io_priority
         if mode is AIOBLOCK_MODE_POLL:
-            self.event_mask = event_mask
+            if event_mask:
+                self.event_mask = event_mask
         else:
             self.buffer_list = buffer_list
-            self.offset = offset
-            self.rw_flags = rw_flags
-        self.eventfd = eventfd
+            if offset:
+                self.offset = offset
+            if rw_flags:
+                self.rw_flags = rw_flags
+        if eventfd is not None:
+            self.eventfd = eventfd
         self.onCompletion = onCompletion
 
     @property
@@ -208,7 +344,9 @@ class AIOBlock(object):
 
     @mode.setter
     def mode(self, value):
-        old_opcode = self._iocb.aio_lio_opcode
+        iocb = self._iocb
+        old_opcode = iocb.aio_lio_opcode
+        old_opcode = self._VECTOR_OPCODE_DICT.get(old_opcode, old_opcode)
         new_opcode = self._AIOBLOCK_MODE_DICT[value]
         if old_opcode != new_opcode:
             if new_opcode == libaio.IO_CMD_POLL:
@@ -217,7 +355,14 @@ class AIOBlock(object):
                 self.rw_flags = 0
             elif old_opcode == libaio.IO_CMD_POLL:
                 self.event_mask = 0
-        self._iocb.aio_lio_opcode = new_opcode
+        buffer_list = self._buffer_list
+        if (
+            buffer_list is not None and
+            len(buffer_list) == 1 and
+            new_opcode in self._SINGLE_BUFFER_OPCODE_DICT
+        ):
+            new_opcode = self._SINGLE_BUFFER_OPCODE_DICT[new_opcode]
+        iocb.aio_lio_opcode = new_opcode
 
     @property
     def target_file(self):
@@ -232,7 +377,9 @@ class AIOBlock(object):
         if value is None:
             self._iocb.aio_fildes = 0
         else:
-            self._iocb.aio_fildes = getattr(value, 'fileno', lambda: value)()
+            self._iocb.aio_fildes = (
+                value if isinstance(value, int) else value.fileno()
+            )
 
     @property
     def buffer_list(self):
@@ -257,21 +404,37 @@ class AIOBlock(object):
         # mutating "value".
         buffer_list = tuple(value)
         iocb = self._iocb
-        iocb.u.c.nbytes = buffer_count = len(buffer_list)
-        if buffer_count:
-            self._iovec = iovec = (libaio.iovec * buffer_count)(*[
-                libaio.iovec(
-                    c_void_p(addressof(c_char.from_buffer(x))),
-                    # Mimic file.write, with workaround for python2.7 bug:
-                    # mmap objects are rejected by memoryview.
-                    len(x if isinstance(x, mmap) else memoryview(x)),
+        opcode = iocb.aio_lio_opcode
+        opcode = self._VECTOR_OPCODE_DICT.get(opcode, opcode)
+        buffer_count = len(buffer_list)
+        if buffer_count == 1:
+            # Most common case: point the iocb directly at the buffer.
+            buf, = buffer_list
+            iocb.u.c.buf = addressof(c_char.from_buffer(buf))
+            # Mimic file.write.
+            iocb.u.c.nbytes = memoryview(buf).nbytes
+            opcode = self._SINGLE_BUFFER_OPCODE_DICT.get(opcode, opcode)
+        elif buffer_count:
+            iovec = self._iovec
+            # Reuse the previous iovec array when it is large enough.
+            # The kernel copies it during submission, so in-flight transfers
+            # are not affected.
+            if iovec is None or len(iovec) < buffer_count:
+                self._iovec = iovec = (libaio.iovec * buffer_count)()
+            c_char_from_buffer = c_char.from_buffer
+            iovec[:buffer_count] = [
+                (
+                    addressof(c_char_from_buffer(x)),
+                    memoryview(x).nbytes,
                 )
                 for x in buffer_list
-            ])
-            iocb.u.c.buf = c_void_p(addressof(iovec))
+            ]
+            iocb.u.c.buf = addressof(iovec)
+            iocb.u.c.nbytes = buffer_count
         else:
             iocb.u.c.buf = None
-            self._iovec = None
+            iocb.u.c.nbytes = 0
+        iocb.aio_lio_opcode = opcode
         self._buffer_list = buffer_list
 
     @property
@@ -298,11 +461,11 @@ class AIOBlock(object):
 
         Only available in mode != AIOBLOCK_MODE_POLL.
         """
-        return self._iocb.u.c.offset
+        return _unpackIOCBOffset(self._iocb, _IOCB_OFFSET_OFFSET)[0]
 
     @offset.setter
     def offset(self, value):
-        self._iocb.u.c.offset = value
+        _packIOCBOffset(self._iocb, _IOCB_OFFSET_OFFSET, value)
 
     @property
     def onCompletion(self):
@@ -373,8 +536,25 @@ class AIOBlock(object):
             iocb.u.c.resfd = 0
         else:
             iocb.u.c.flags |= libaio.IOCB_FLAG_RESFD
-            iocb.u.c.resfd = getattr(value, 'fileno', lambda: value)()
-        self._eventfd = eventfd
+            iocb.u.c.resfd = (
+                value if isinstance(value, int) else value.fileno()
+            )
+        self._eventfd = value
+
+    def reset(self, mode=None, offset=None, rw_flags=None):
+        """
+        Prepare this instance for another submission.
+
+        Only given values are changed: all other settings, including
+        buffer_list, are kept from previous submission. This is cheaper than
+        constructing a new instance, see AIOBlockPool.
+        """
+        if mode is not None:
+            self.mode = mode
+        if offset is not None:
+            self.offset = offset
+        if rw_flags is not None:
+            self.rw_flags = rw_flags
 
     def _getSubmissionState(self):
         """
@@ -383,36 +563,261 @@ class AIOBlock(object):
         # Returns all values which must not be garbage collected until completion.
         return (self._buffer_list, self._iovec)
 
-class AIOContext(object):
+class AIOBlockPool:
+    """
+    Pool of reusable AIOBlock instances, each with its own buffer.
+
+    Blocks are returned to the pool once their completion callback returns,
+    so the callback must be done with the block's buffer by then.
+    """
+    _arena = None
+
+    def __init__(
+        self,
+        mode,
+        target_file,
+        buffer_size,
+        # pylint: disable=redefined-outer-name
+        eventfd=None,
+        # pylint: enable=redefined-outer-name
+        rw_flags=0,
+        io_priority=None,
+        block_count=None,
+        lock=False,
+    ):
+        """
+        mode (AIOBLOCK_MODE_READ, AIOBLOCK_MODE_WRITE)
+        target_file (file-ish)
+            See AIOBlock.
+        buffer_size (int)
+            Size of the buffer of each block.
+        eventfd (EventFD)
+        rw_flags (int)
+        io_priority (int)
+            See AIOBlock.
+        block_count (int, None)
+            If None, blocks are allocated on demand, each with its own mmap.
+            Otherwise, this many blocks are allocated upfront, with their
+            buffers carved out of a single mmap and their iocbs out of a
+            single array, and acquire fails once they are all in use.
+            Buffers are page-aligned if buffer_size is a multiple of
+            mmap.PAGESIZE.
+        lock (bool)
+            Whether to mlock the buffers, so the kernel does not have to fault
+            them in on every transfer. Requires block_count.
+            Subject to RLIMIT_MEMLOCK.
+        """
+        self._mode = mode
+        self._target_file = target_file
+        self._buffer_size = buffer_size
+        self._eventfd = eventfd
+        self._rw_flags = rw_flags
+        self._io_priority = io_priority
+        self._free_list = []
+        self._onCompletion_dict = {}
+        if block_count is None:
+            if lock:
+                raise ValueError('lock requires block_count')
+        else:
+            self._arena = arena = mmap(-1, buffer_size * block_count)
+            if lock:
+                mman.mlock(addressof(c_char.from_buffer(arena)), len(arena))
+            buffer_type = c_char * buffer_size
+            iocb_array = (libaio.iocb * block_count)()
+            self._free_list.extend(
+                self._newBlock(
+                    buffer_type.from_buffer(arena, index * buffer_size),
+                    0,
+                    iocb_array[index],
+                )
+                for index in range(block_count)
+            )
+
+    def _newBlock(self, buf, offset, iocb=None):
+        return AIOBlock(
+            mode=self._mode,
+            target_file=self._target_file,
+            buffer_list=[buf],
+            offset=offset,
+            eventfd=self._eventfd,
+            onCompletion=self._onCompletion,
+            rw_flags=self._rw_flags,
+            io_priority=self._io_priority,
+            iocb=iocb,
+        )
+
+    def acquire(self, offset, onCompletion=lambda block, res, res2: None):
+        """
+        Get a block from the pool, allocating one if none is available.
+
+        offset (int)
+        onCompletion (callable)
+            See AIOBlock.
+
+        The block's buffer is available as block.buffer_list[0].
+        Raises IndexError if the pool was created with a block_count and all
+        its blocks are in use.
+        """
+        try:
+            block = self._free_list.pop()
+        except IndexError:
+            if self._arena is not None:
+                raise
+            block = self._newBlock(mmap(-1, self._buffer_size), offset)
+        else:
+            block.reset(offset=offset)
+        self._onCompletion_dict[block] = onCompletion
+        return block
+
+    def release(self, block):
+        """
+        Return a block which will not be submitted to the pool.
+        """
+        del self._onCompletion_dict[block]
+        self._free_list.append(block)
+
+    def _onCompletion(self, block, res, res2):
+        try:
+            self._onCompletion_dict[block](block, res, res2)
+        finally:
+            self.release(block)
+
+class AIOContext:
     """
     Linux Ashynchronous IO context.
+
+    The kernel is called without holding the GIL, so one thread may submit
+    blocks while another one waits for and processes events. Blocks must then
+    not be deferred, either by submit or by per_file_limit.
     """
     _ctx = None
+    _ring_head = None
+    _EVENT_TYPE = libaio.io_event
+    _EVENT_SIZE = sizeof(libaio.io_event)
+    # Yields data, res, res2
+    _unpackEventList = _getEventStruct(
+        libaio.io_event,
+        ('data', False),
+        ('res', True),
+        ('res2', True),
+    ).iter_unpack
+    # Index of data, res and res2 in an event seen as 64 bits words, if they
+    # all are 64 bits.
+    _EVENT_WORD_INDEX_LIST = _getEventWordIndexList(
+        libaio.io_event,
+        'data',
+        'res',
+        'res2',
+    )
 
-    def __init__(self, maxevents):
+    def __init__(
+        self,
+        maxevents,
+        submit_batch=1,
+        submit_low_water=0,
+        per_file_limit=None,
+    ):
         """
         maxevents (int)
             Maximum number of events this context will have to handle.
+        submit_batch (int)
+            Number of deferred blocks (see submit) above which they get
+            submitted.
+        submit_low_water (int)
+            Number of in-flight blocks below which deferred blocks get
+            submitted, so the kernel does not run out of work while a batch is
+            being accumulated.
+        per_file_limit (int, None)
+            If not None, maximum number of in-flight blocks per file
+            descriptor. Submitted blocks above this limit are held back, and
+            handed off to kernel once earlier blocks on the same file
+            complete. Some files, like network filesystems, perform much worse
+            when given too many concurrent operations (16 is a reasonable
+            start for these).
+            Unlimited by default, as other files are often given many blocks
+            on purpose (ex: USB gadget endpoints), and so existing callers
+            are not throttled.
         """
-        self._maxevents = maxevents
-        self._submitted = {}
+        self._initCommon(
+            maxevents,
+            submit_batch,
+            submit_low_water,
+            per_file_limit,
+        )
+        # Reused by every submission, to not allocate one array per call.
+        self._submit_array = (libaio.iocb_p * max(maxevents, submit_batch))()
+        # Reused by every cancel call.
+        self._cancel_event = cancel_event = libaio.io_event()
+        self._cancel_event_p = pointer(cancel_event)
+        # Reused by every getEvents call with a timeout.
+        self._zero_timeout_p = pointer(libaio.timespec(0, 0))
+        self._timeout = timeout = libaio.timespec()
+        self._timeout_p = pointer(timeout)
         # Avoid garbage collection issues on interpreter shutdown.
         self._io_queue_release = libaio.io_queue_release
         ctx = libaio.io_context_t()
         # Note: almost same as io_setup
         libaio.io_queue_init(self._maxevents, byref(ctx))
         self._ctx = ctx
+        # ctx is the address of the completion ring, mapped in this process.
+        ring_address = cast(ctx, c_void_p).value
+        ring = libaio.aio_ring.from_address(ring_address)
+        if (
+            _ORDERED_MEMORY_ACCESS and
+            ring.magic == libaio.AIO_RING_MAGIC and
+            ring.incompat_features == libaio.AIO_RING_INCOMPAT_FEATURES
+        ):
+            self._ring_nr = ring.nr
+            self._ring_head = c_uint.from_address(
+                ring_address + libaio.aio_ring.head.offset,
+            )
+            self._ring_tail = c_uint.from_address(
+                ring_address + libaio.aio_ring.tail.offset,
+            )
+            self._ring_events_address = ring_address + ring.header_length
+
+    def _initCommon(
+        self,
+        maxevents,
+        submit_batch,
+        submit_low_water,
+        per_file_limit,
+    ):
+        """
+        For internal use only.
+        """
+        # Constructor arguments shared by all context classes.
+        if per_file_limit is not None and per_file_limit < 1:
+            raise ValueError('per_file_limit must be at least 1')
+        self._maxevents = maxevents
+        self._submit_batch = submit_batch
+        self._submit_low_water = submit_low_water
+        self._per_file_limit = per_file_limit
+        # Number of in-flight blocks per file descriptor, maintained only
+        # with a per_file_limit.
+        self._in_flight_dict = {}
+        self._submitted = {}
+        self._pending_submit = []
+        # Reused by every getEvents call, and grown on demand.
+        self._event_buffer = event_buffer = (self._EVENT_TYPE * maxevents)()
+        self._event_view = memoryview(event_buffer).cast('B')
 
     def close(self):
         """
         Cancels all pending IO blocks.
         Waits until all non-cancellable IO blocks finish.
         De-initialises AIO context.
+
+        Completion events of these blocks are not produced, and their
+        onCompletion callbacks are not called. Use cancelAll and getEvents
+        before closing if they are needed.
         """
         if self._ctx is not None:
             # Note: same as io_destroy
             self._io_queue_release(self._ctx)
             del self._ctx
+            # Unmapped by io_queue_release.
+            self._ring_head = None
 
     def __enter__(self):
         """
@@ -433,56 +838,237 @@ class AIOContext(object):
         """
         self.close()
 
-    def submit(self, block_list):
+    def submit(self, block_list, defer=False):
         """
         Submits transfers.
 
         block_list (list of AIOBlock)
             The IO blocks to hand off to kernel.
+        defer (bool)
+            When true, blocks are queued instead of being immediately handed
+            off to kernel. Queued blocks are submitted along with the blocks of
+            a later call, once submit_batch blocks are queued, once there are
+            less than submit_low_water blocks in flight, or by calling flush.
+
+        Returns the number of successfully submitted blocks, including blocks
+        deferred by earlier calls and blocks kept deferred by per_file_limit
+        (see flush). If blocks were only queued, returns the number of queued
+        blocks.
+        """
+        self._register(block_list)
+        pending_submit = self._pending_submit
+        if not (defer or pending_submit or self._per_file_limit is not None):
+            # Bypass the deferred block list, so a thread fetching events
+            # cannot flush these blocks while they are being submitted.
+            return self._submitBlockList(block_list)
+        pending_submit.extend(block_list)
+        if (
+            defer and
+            len(pending_submit) < self._submit_batch and
+            len(self._submitted) - len(pending_submit) >=
+            self._submit_low_water
+        ):
+            return len(block_list)
+        submitted_count = self.flush()
+        # Only blocks held back by per_file_limit may remain.
+        return submitted_count + len(self._pending_submit)
+
+    def flush(self):
+        """
+        Submits transfers deferred by submit.
 
         Returns the number of successfully submitted blocks.
+        Blocks which could not be submitted are dropped, and may be submitted
+        again. With per_file_limit, they stay deferred instead, along with
+        blocks held back by it.
+        """
+        block_list = self._pending_submit
+        if not block_list:
+            return 0
+        if self._per_file_limit is None:
+            self._pending_submit = []
+            return self._submitBlockList(block_list)
+        block_list, self._pending_submit = self._splitPerFile(block_list)
+        if not block_list:
+            return 0
+        submitted_count = self._submitBlockList(block_list)
+        self._addInFlight(block_list[:submitted_count])
+        if submitted_count < len(block_list):
+            # Held back blocks may have been submitted by an earlier call:
+            # their caller cannot know it has to submit them again.
+            rejected_list = block_list[submitted_count:]
+            self._register(rejected_list)
+            self._pending_submit[:0] = rejected_list
+        return submitted_count
+
+    def _submitBlockList(self, block_list):
+        """
+        For internal use only.
+        """
+        block_count = len(block_list)
+        submit_array = self._submit_array
+        if block_count > len(submit_array):
+            submit_array = (libaio.iocb_p * block_count)()
+        # Writing all addresses at once is much faster than assigning pointer
+        # objects to the array.
+        pack_into(
+            '%iP' % block_count,
+            submit_array,
+            0,
+            *[
+                # pylint: disable=protected-access
+                x._iocb_address
+                # pylint: enable=protected-access
+                for x in block_list
+            ]
+        )
+        return self._submitArray(block_list, submit_array)
+
+    def _splitPerFile(self, block_list):
+        """
+        For internal use only.
+        """
+        # Returns the blocks which can be handed off to kernel without
+        # exceeding per_file_limit, and the ones which must be held back.
+        limit = self._per_file_limit
+        getInFlight = self._in_flight_dict.get
+        # Counts including the blocks to hand off, for the files seen so far.
+        planned_dict = {}
+        ready_list = []
+        held_list = []
+        for block in block_list:
+            # pylint: disable=protected-access
+            fd = block._iocb.aio_fildes
+            # pylint: enable=protected-access
+            in_flight = planned_dict.get(fd)
+            if in_flight is None:
+                in_flight = getInFlight(fd, 0)
+            if in_flight < limit:
+                planned_dict[fd] = in_flight + 1
+                ready_list.append(block)
+            else:
+                held_list.append(block)
+        return ready_list, held_list
+
+    def _addInFlight(self, block_list):
+        """
+        For internal use only.
+        """
+        # Only called with a per_file_limit.
+        in_flight_dict = self._in_flight_dict
+        for block in block_list:
+            # pylint: disable=protected-access
+            fd = block._iocb.aio_fildes
+            # pylint: enable=protected-access
+            in_flight_dict[fd] = in_flight_dict.get(fd, 0) + 1
+
+    def _removeInFlight(self, event_data):
+        """
+        For internal use only.
+        """
+        # Only called with a per_file_limit, before completed blocks are
+        # unregistered.
+        in_flight_dict = self._in_flight_dict
+        submitted = self._submitted
+        for event in self._unpackEventList(event_data):
+            # pylint: disable=protected-access
+            in_flight_dict[submitted[event[0]][0]._iocb.aio_fildes] -= 1
+            # pylint: enable=protected-access
+
+    @staticmethod
+    def getSubmitArray(block_list):
         """
+        Returns an array of pointers to given blocks' iocbs, for submitRaw.
+        """
+        block_count = len(block_list)
+        result = (libaio.iocb_p * block_count)()
+        pack_into(
+            '%iP' % block_count,
+            result,
+            0,
+            *[
+                # pylint: disable=protected-access
+                x._iocb_address
+                # pylint: enable=protected-access
+                for x in block_list
+            ]
+        )
+        return result
+
+    def submitRaw(self, block_list, submit_array):
+        """
+        Submits transfers, using a caller-provided iocb pointer array.
+
+        For callers repeatedly submitting the same groups of blocks: building
+        the array is the main per-call cost of submit, and can be done only
+        once per group with getSubmitArray.
+
+        block_list (list of AIOBlock)
+            The IO blocks to hand off to kernel.
+        submit_array (ctypes array of libaio.iocb_p)
+            Pointers to the iocbs of block_list, in the same order, as returned
+            by getSubmitArray. Only used during this call.
+
+        Deferred blocks are not submitted by this call.
+
+        Returns the number of successfully submitted blocks.
+        """
+        if len(submit_array) < len(block_list):
+            raise ValueError('submit_array is too short')
+        self._register(block_list)
+        submitted_count = self._submitArray(block_list, submit_array)
+        if self._per_file_limit is not None:
+            self._addInFlight(block_list[:submitted_count])
+        return submitted_count
+
+    def _register(self, block_list):
         # A non-set file will cause an AIO block on stdin, which is likely not
         # expected. Do this extra check when assertions are enabled.
         assert not any(x.target_file is None for x in block_list)
         submitted = self._submitted
-        tested_count = submitted_count = 0
+        registered_count = 0
         try:
-            for tested_count, block in enumerate(block_list):
-                # pylint: disable=protected-access
-                block_key = addressof(block._iocb)
-                # pylint: enable=protected-access
+            for block in block_list:
+                block_key = id(block)
                 if block_key in submitted:
                     raise ValueError('Already submitted: %r' % (block, ))
                 # pylint: disable=protected-access
                 submitted[block_key] = (block, block._getSubmissionState())
                 # pylint: enable=protected-access
-            tested_count += 1
-            submitted_count = libaio.io_submit(
+                registered_count += 1
+        finally:
+            if registered_count != len(block_list):
+                # Remove any registered transfer
+                for block in block_list[:registered_count]:
+                    submitted.pop(id(block), None)
+
+    def _submitArray(self, block_list, submit_array):
+        submitted_count = 0
+        try:
+            result = libaio.io_submit_raw(
                 self._ctx,
                 len(block_list),
-                (libaio.iocb_p * len(block_list))(*[
-                    # pylint: disable=protected-access
-                    pointer(x._iocb)
-                    # pylint: enable=protected-access
-                    for x in block_list
-                ]),
+                submit_array,
             )
+            if result < 0:
+                raise OSError(-result, 'io_submit')
+            submitted_count = result
         finally:
             # Remove any non-submitted transfer
-            for block in block_list[submitted_count:tested_count]:
-                # pylint: disable=protected-access
-                submitted.pop(addressof(block._iocb), None)
-                # pylint: enable=protected-access
+            submitted = self._submitted
+            for block in block_list[submitted_count:]:
+                submitted.pop(id(block), None)
         return submitted_count
 
     def _eventToPython(self, event):
-        aio_block, _ = self._submitted.pop(addressof(event.obj.contents))
-        aio_block.onCompletion(aio_block, event.res, event.res2)
+        aio_block, _ = self._submitted.pop(event.data)
+        res = event.res
+        res2 = event.res2
+        aio_block.onCompletion(aio_block, res, res2)
         return (
             aio_block,
-            event.res,
-            event.res2,
+            res,
+            res2,
         )
 
     def cancel(self, block):
@@ -495,17 +1081,27 @@ class AIOContext(object):
         Returns cancelled block's event data (see getEvents), or None if the
         kernel returned EINPROGRESS. In the latter case, event completion will
         happen on a later getEvents call.
+
+        Deferred blocks are submitted first.
         """
-        event = libaio.io_event()
+        self.flush()
         try:
-            # pylint: disable=protected-access
-            libaio.io_cancel(self._ctx, byref(block._iocb), byref(event))
-            # pylint: enable=protected-access
+            libaio.io_cancel(
+                self._ctx,
+                # pylint: disable=protected-access
+                block._iocb_p,
+                # pylint: enable=protected-access
+                self._cancel_event_p,
+            )
         except OSError as exc:
             if exc.errno == errno.EINPROGRESS:
                 return None
             raise
-        return self._eventToPython(event)
+        if self._per_file_limit is not None:
+            # pylint: disable=protected-access
+            self._in_flight_dict[block._iocb.aio_fildes] -= 1
+            # pylint: enable=protected-access
+        return self._eventToPython(self._cancel_event)
 
     def cancelAll(self):
         """
@@ -516,10 +1112,24 @@ class AIOContext(object):
         method is running produces undefined behaviour.
         Returns the list of values returned by individual cancellations.
         See "cancel" documentation.
+        Deferred blocks are submitted first.
+
+        There is no need to call this before close, which lets the kernel
+        cancel all blocks in a single call.
+
+        Blocks held back by per_file_limit are dropped, without producing
+        completion events.
         """
+        self.flush()
+        submitted = self._submitted
+        for block in self._pending_submit:
+            del submitted[id(block)]
+        del self._pending_submit[:]
         cancel = self.cancel
         result = []
-        for block, _ in self._submitted.values():
+        # cancel removes blocks from self._submitted when the kernel returns
+        # their event immediately, so iterate over a copy.
+        for block, _ in list(self._submitted.values()):
             try:
                 result.append(cancel(block))
             except OSError as exc:
@@ -530,6 +1140,74 @@ class AIOContext(object):
                     raise
         return result
 
+    def run(self, block_iterable, depth):
+        """
+        Submits blocks, keeping depth blocks in flight until block_iterable
+        is exhausted, then waits for all blocks to complete.
+
+        block_iterable (iterable of AIOBlock)
+            The IO blocks to hand off to kernel. It is consumed as blocks
+            complete, so it may produce blocks which completed earlier.
+        depth (int)
+            Number of blocks to keep in flight, including blocks submitted
+            by other means.
+
+        Completions are reported to the onCompletion callback of each block.
+
+        Returns the number of completed blocks.
+        """
+        block_iterator = iter(block_iterable)
+        submitted = self._submitted
+        pending = []
+        exhausted = False
+        completed = 0
+        while True:
+            wanted = depth - len(submitted)
+            if wanted > 0:
+                if not exhausted and len(pending) < wanted:
+                    missing = wanted - len(pending)
+                    pending.extend(islice(block_iterator, missing))
+                    exhausted = len(pending) < wanted
+                if pending:
+                    self.submit(pending[:wanted])
+                    # Blocks the kernel did not accept are unregistered: they
+                    # are submitted again once some complete. The count submit
+                    # returns cannot tell which, as it includes blocks held
+                    # back by per_file_limit in earlier calls.
+                    pending = [x for x in pending if id(x) not in submitted]
+            if not submitted:
+                if pending:
+                    continue
+                break
+            completed += self.processEvents()
+        return completed
+
+    def drainCompletions(self, eventfd, nr=None):
+        """
+        Returns event data (see getEvents) of blocks counted by given eventfd.
+
+        eventfd (EventFD)
+            Must be the eventfd given to the completed AIOBlocks, and must not
+            have been created with EFD_SEMAPHORE, so a single read fetches the
+            number of completions since the previous read.
+        nr (int, None)
+            Maximum number of events to return.
+            If None, all counted events are returned.
+            Otherwise, the remainder is added back to eventfd counter, so it
+            stays readable.
+
+        Intended to be called when eventfd is reported readable by
+        select/poll/epoll: fetches all the completions this notification
+        stands for with a single non-blocking getEvents call.
+        """
+        count = eventfd.read()
+        if not count:
+            return []
+        if nr is not None and count > nr:
+            eventfd.write(count - nr)
+            count = nr
+        return self.getEvents(min_nr=count, nr=count, timeout=0)
+
     def getEvents(self, min_nr=1, nr=None, timeout=None):
         """
         Returns a list of event data from submitted IO blocks.
@@ -545,31 +1223,913 @@ class AIOContext(object):
         timeout (float, None):
             Time to wait for events.
             If None, become blocking.
+            If zero or negative and no block is submitted, returns
+            immediately without calling the kernel.
 
         Returns a list of 3-tuples, containing:
         - completed AIOBlock instance
         - res, file-object-type-dependent value
         - res2, another file-object-type-dependent value
+
+        Deferred blocks are submitted first. If completions bring the number of
+        in-flight blocks below submit_low_water, blocks deferred by completion
+        callbacks are submitted before returning.
+        """
+        return self._getEvents(min_nr, nr, timeout, self._eventListToPython)
+
+    def processEvents(self, min_nr=1, nr=None, timeout=None):
+        """
+        Calls completion callbacks of submitted IO blocks.
+
+        Same as getEvents, for callers which only rely on onCompletion: avoids
+        building the event data list.
+
+        Returns the number of completed blocks.
+        """
+        return self._getEvents(min_nr, nr, timeout, self._processEventList)
+
+    def getEventsInto(self, event_array, min_nr=1, timeout=None):
+        """
+        Stores completion events of submitted IO blocks into event_array,
+        without calling completion callbacks.
+
+        event_array (writable buffer)
+            Receives one row of 3 native signed 64 bits integers per event:
+            id() of the completed AIOBlock, res and res2.
+            Its size sets the maximum number of events to fetch.
+            Ex: (ctypes.c_int64 * 3 * maxevents)()
+        min_nr (int, None)
+        timeout (float, None)
+            See getEvents.
+
+        For callers processing completions in bulk: avoids one python call
+        and one tuple per event. Completed blocks are no longer referenced by
+        this context, so the caller must keep references to them to map ids
+        back to blocks (ex: in a dict keyed by id(block)).
+
+        Returns the number of stored events.
         """
+        return self._getEvents(
+            min_nr,
+            memoryview(event_array).nbytes // _EVENT_ROW_SIZE,
+            timeout,
+            partial(self._storeEventList, event_array),
+        )
+
+    def _storeEventList(self, event_array, event_data):
+        word_index_list = self._EVENT_WORD_INDEX_LIST
+        if word_index_list is None or not event_data:
+            pop = self._submitted.pop
+            value_list = []
+            extend = value_list.extend
+            for event in self._unpackEventList(event_data):
+                pop(event[0])
+                extend(event)
+            pack_into('=%iq' % len(value_list), event_array, 0, *value_list)
+            return len(value_list) // 3
+        # Copy each field with a single strided assignment, so unregistering
+        # blocks is the only per-event python code.
+        event_word_list = event_data.cast('q')
+        event_word_count = self._EVENT_SIZE // 8
+        count = len(event_word_list) // event_word_count
+        row_word_list = memoryview(event_array).cast('B').cast('q')
+        for column, word_index in enumerate(word_index_list):
+            row_word_list[
+                column:count * 3:3
+            ] = event_word_list[word_index::event_word_count]
+        pop = self._submitted.pop
+        for block_key in row_word_list[0:count * 3:3].tolist():
+            pop(block_key)
+        return count
+
+    def _eventListToPython(self, event_data):
+        # Same as calling _eventToPython on each event, minus one python call
+        # per event. Unpacking the raw events is cheaper than going through
+        # ctypes structures.
+        pop = self._submitted.pop
+        result = []
+        append = result.append
+        for data, res, res2 in self._unpackEventList(event_data):
+            aio_block, _ = pop(data)
+            aio_block.onCompletion(aio_block, res, res2)
+            append((aio_block, res, res2))
+        return result
+
+    def _processEventList(self, event_data):
+        pop = self._submitted.pop
+        for data, res, res2 in self._unpackEventList(event_data):
+            aio_block, _ = pop(data)
+            aio_block.onCompletion(aio_block, res, res2)
+        return len(event_data) // self._EVENT_SIZE
+
+    def _getEvents(self, min_nr, nr, timeout, processEventList):
+        if not self._submitted and timeout is not None and timeout <= 0:
+            # Nothing can complete: spare a syscall to non-blocking pollers.
+            return processEventList(b'')
+        self.flush()
         if min_nr is None:
-            min_nr = len(self._submitted)
+            # Blocks held back by per_file_limit cannot complete yet.
+            min_nr = len(self._submitted) - len(self._pending_submit)
         if nr is None:
             nr = max(len(self._submitted), self._maxevents)
+        event_buffer = self._event_buffer
+        # Completion callbacks may call getEvents: prevent them from reusing
+        # the buffer while it is being processed.
+        self._event_buffer = None
+        if event_buffer is None or len(event_buffer) < nr:
+            event_buffer = (self._EVENT_TYPE * nr)()
+            event_view = memoryview(event_buffer).cast('B')
+        else:
+            event_view = self._event_view
+        try:
+            event_data = event_view[:self._fetchEvents(
+                min_nr,
+                nr,
+                timeout,
+                event_buffer,
+            ) * self._EVENT_SIZE]
+            if self._per_file_limit is not None:
+                self._removeInFlight(event_data)
+            result = processEventList(event_data)
+        finally:
+            self._event_buffer = event_buffer
+            self._event_view = event_view
+        pending_submit = self._pending_submit
+        if pending_submit and (
+            # Completions may allow held back blocks in.
+            self._per_file_limit is not None or
+            len(self._submitted) - len(pending_submit) <
+            self._submit_low_water
+        ):
+            self.flush()
+        return result
+
+    def _fetchEvents(self, min_nr, nr, timeout, event_buffer):
+        """
+        For internal use only.
+        """
+        # Copies up to nr completion events into event_buffer, waiting for
+        # min_nr of them for up to timeout seconds.
+        # Returns the number of copied events.
+        ring_head = self._ring_head
+        if ring_head is not None:
+            # Fetch already-available events without a syscall, like the
+            # kernel does in io_getevents.
+            ring_nr = self._ring_nr
+            head = ring_head.value
+            available = (self._ring_tail.value - head) % ring_nr
+            if available >= min_nr or timeout == 0:
+                count = min(available, nr)
+                if count:
+                    event_size = self._EVENT_SIZE
+                    first_count = min(count, ring_nr - head)
+                    buffer_address = addressof(event_buffer)
+                    events_address = self._ring_events_address
+                    memmove(
+                        buffer_address,
+                        events_address + head * event_size,
+                        first_count * event_size,
+                    )
+                    if first_count < count:
+                        memmove(
+                            buffer_address + first_count * event_size,
+                            events_address,
+                            (count - first_count) * event_size,
+                        )
+                    ring_head.value = (head + count) % ring_nr
+                return count
         if timeout is None:
             timeoutp = None
+        elif timeout == 0:
+            timeoutp = self._zero_timeout_p
         else:
             sec = int(timeout)
-            timeout = libaio.timespec(sec, int((timeout - sec) * 1e9))
-            timeoutp = byref(timeout)
-        event_buffer = (libaio.io_event * nr)()
-        actual_nr = libaio.io_getevents(
+            timespec = self._timeout
+            timespec.tv_sec = sec
+            timespec.tv_nsec = int((timeout - sec) * 1e9)
+            timeoutp = self._timeout_p
+        result = libaio.io_getevents_raw(
             self._ctx,
             min_nr,
             nr,
             event_buffer,
             timeoutp,
         )
-        return [
-            self._eventToPython(event_buffer[x])
-            for x in range(actual_nr)
+        if result < 0:
+            raise OSError(-result, 'io_getevents')
+        return result
+
+class IOUringContext(AIOContext):
+    """
+    Linux io_uring context, usable in place of AIOContext.
+
+    AIOBlocks are translated into submission queue entries when submitted, so
+    the same blocks can be used with either context class. Completion events
+    are read from the ring shared with the kernel, without a syscall when
+    they are already available.
+
+    Differences with AIOContext:
+    - res2 is always 0
+    - AIOBlock.eventfd is not supported: an eventfd can instead be given to
+      the context, and is then signalled when completion events are produced
+    - AIOBLOCK_MODE_POLL blocks only report requested events, plus EPOLLERR
+      and EPOLLHUP
+    - invalid blocks are reported by a completion event with a negative res
+      rather than by an exception when submitted
+    - cancel never returns event data: cancelled blocks complete on a later
+      getEvents call
+    - on single-buffer read and write blocks, an offset of -1 means the
+      current file position rather than being invalid
+
+    Requires Linux 6.0 or later. Not available on alpha and mips, whose
+    io_uring syscall numbers differ.
+    """
+    _ring_fd = None
+    _EVENT_TYPE = io_uring.io_uring_cqe
+    _EVENT_SIZE = sizeof(io_uring.io_uring_cqe)
+    # Yields user_data, res
+    _unpackEventList = _getEventStruct(
+        io_uring.io_uring_cqe,
+        ('user_data', False),
+        ('res', True),
+    ).iter_unpack
+    _GETEVENTS_ARG_SIZE = sizeof(io_uring.io_uring_getevents_arg)
+
+    def __init__(
+        self,
+        maxevents,
+        submit_batch=1,
+        submit_low_water=0,
+        eventfd=None,
+        sqpoll_idle=None,
+        iopoll=False,
+        per_file_limit=None,
+    ):
+        """
+        maxevents (int)
+            Maximum number of events this context will have to handle.
+            Rounded up to the next power of 2 by the kernel.
+        submit_batch (int)
+        submit_low_water (int)
+        per_file_limit (int, None)
+            See AIOContext.
+        eventfd (EventFD, int)
+            An eventfd file, signalled when completion events are produced,
+            so they can be waited upon by select/poll/epoll.
+            Its counter is not a number of completions: when it is readable,
+            read it and call getEvents with a zero timeout.
+        sqpoll_idle (int, None)
+            If not None, a kernel thread picks up submitted blocks, so
+            submitting them does not need a syscall while this thread is
+            running. It goes to sleep after this many milliseconds without
+            submissions, and is then woken up by the next submission.
+            Not available on all architectures.
+        iopoll (bool)
+            If true, completions are busy-polled from the device instead of
+            being signalled by interrupts, which lowers latency on fast
+            storage at the cost of CPU time while waiting for events.
+            Only read and write blocks are accepted. Their files must be
+            opened with O_DIRECT, and their buffers and offsets must follow
+            O_DIRECT alignment rules. The device must support polling (ex:
+            NVMe with poll queues). Otherwise, blocks complete with
+            -EOPNOTSUPP: files are not checked when submitting, as it would
+            cost a syscall per block.
+        """
+        # pylint: disable=super-init-not-called
+        if not _IO_URING_SYSCALLS:
+            raise NotImplementedError(
+                'io_uring is not supported on this architecture',
+            )
+        self._initCommon(
+            maxevents,
+            submit_batch,
+            submit_low_water,
+            per_file_limit,
+        )
+        # Reused by every getEvents call with a timeout.
+        self._timeout = timeout = io_uring.kernel_timespec()
+        self._getevents_arg_p = pointer(
+            io_uring.io_uring_getevents_arg(ts=addressof(timeout)),
+        )
+        # Reused by every cancel call. Wait for in-progress blocks to complete.
+        self._cancel_reg = io_uring.io_uring_sync_cancel_reg(
+            timeout=io_uring.kernel_timespec(-1, -1),
+        )
+        params = io_uring.io_uring_params()
+        self._iopoll = iopoll
+        if iopoll:
+            params.flags = io_uring.IORING_SETUP_IOPOLL
+        self._sqpoll = sqpoll = sqpoll_idle is not None
+        if sqpoll:
+            if not _ORDERED_MEMORY_ACCESS:
+                raise NotImplementedError(
+                    'sqpoll is not supported on this architecture',
+                )
+            params.flags |= io_uring.IORING_SETUP_SQPOLL
+            params.sq_thread_idle = sqpoll_idle
+            # Reused by every submission, see _submitSQPoll.
+            self._sq_new_tail = c_uint32()
+        ring_fd = io_uring.io_uring_setup(maxevents, byref(params))
+        try:
+            sq_off = params.sq_off
+            cq_off = params.cq_off
+            sq_entries = params.sq_entries
+            cq_entries = params.cq_entries
+            sq_ring = mmap(
+                ring_fd,
+                sq_off.array + sq_entries * sizeof(c_uint32),
+                offset=io_uring.IORING_OFF_SQ_RING,
+            )
+            cq_ring = mmap(
+                ring_fd,
+                cq_off.cqes + cq_entries * self._EVENT_SIZE,
+                offset=io_uring.IORING_OFF_CQ_RING,
+            )
+            sqe_map = mmap(
+                ring_fd,
+                sq_entries * sizeof(io_uring.io_uring_sqe),
+                offset=io_uring.IORING_OFF_SQES,
+            )
+            if eventfd is not None:
+                io_uring.io_uring_register(
+                    ring_fd,
+                    io_uring.IORING_REGISTER_EVENTFD,
+                    byref(c_int32(
+                        eventfd if isinstance(eventfd, int) else
+                        eventfd.fileno()
+                    )),
+                    1,
+                )
+        except Exception:
+            os.close(ring_fd)
+            raise
+        # Keep a reference, so the file is not closed while registered.
+        self._eventfd = eventfd
+        # See registerFiles and registerBuffers.
+        self._fixed_file_dict = {}
+        self._fixed_buffer_base_list = []
+        self._fixed_buffer_list = []
+        # Submission queue entries are used in ring order, so the index array
+        # never changes.
+        (c_uint32 * sq_entries).from_buffer(
+            sq_ring,
+            sq_off.array,
+        )[:] = list(range(sq_entries))
+        self._sq_entries = sq_entries
+        self._sq_mask = sq_entries - 1
+        self._sq_head = c_uint32.from_buffer(sq_ring, sq_off.head)
+        self._sq_tail = c_uint32.from_buffer(sq_ring, sq_off.tail)
+        self._sq_flags = c_uint32.from_buffer(sq_ring, sq_off.flags)
+        self._sqe_map = sqe_map
+        self._cq_entries = cq_entries
+        self._cq_mask = cq_entries - 1
+        self._cq_head = c_uint32.from_buffer(cq_ring, cq_off.head)
+        self._cq_tail = c_uint32.from_buffer(cq_ring, cq_off.tail)
+        self._cqes_address = addressof(
+            (io_uring.io_uring_cqe * cq_entries).from_buffer(
+                cq_ring,
+                cq_off.cqes,
+            ),
+        )
+        # Unmapped when garbage-collected, once the above are gone.
+        self._mmap_list = [sq_ring, cq_ring]
+        # Avoid garbage collection issues on interpreter shutdown.
+        self._close_fd = os.close
+        self._ring_fd = ring_fd
+
+    def close(self):
+        """
+        Cancels all pending IO blocks.
+        Waits until all non-cancellable IO blocks finish.
+        De-initialises io_uring context.
+
+        Completion events of these blocks are not produced, and their
+        onCompletion callbacks are not called. Use cancelAll and getEvents
+        before closing if they are needed.
+        """
+        if self._ring_fd is None:
+            return
+        # Unlike io_destroy, closing the ring does not wait for in-flight
+        # blocks, which may still access their buffers: do it here.
+        in_flight = len(self._submitted) - len(self._pending_submit)
+        if in_flight:
+            self._waitSQPoll()
+            cancel_reg = self._cancel_reg
+            for block_key in self._submitted:
+                cancel_reg.addr = block_key
+                try:
+                    io_uring.io_uring_register(
+                        self._ring_fd,
+                        io_uring.IORING_REGISTER_SYNC_CANCEL,
+                        byref(cancel_reg),
+                        1,
+                    )
+                except OSError:
+                    pass
+            event_buffer = (self._EVENT_TYPE * in_flight)()
+            while in_flight:
+                in_flight -= self._fetchEvents(
+                    in_flight,
+                    in_flight,
+                    None,
+                    event_buffer,
+                )
+        self._submitted.clear()
+        del self._pending_submit[:]
+        self._close_fd(self._ring_fd)
+        del self._ring_fd
+        del (
+            self._sq_head, self._sq_tail, self._sq_flags, self._sqe_map,
+            self._cq_head, self._cq_tail, self._cqes_address,
+            self._mmap_list,
+        )
+
+    def _submitBlockList(self, block_list):
+        """
+        For internal use only.
+        """
+        return self._submitArray(block_list, None)
+
+    def _submitArray(self, block_list, submit_array):
+        # submit_array is for io_submit: blocks are read directly instead.
+        # pylint: disable=unused-argument
+        if self._sqpoll:
+            return self._submitSQPoll(block_list)
+        submitted_count = 0
+        try:
+            block_count = len(block_list)
+            ring_fd = self._ring_fd
+            sq_entries = self._sq_entries
+            sq_tail = self._sq_tail
+            writeSQEs = self._writeSQEs
+            io_uring_enter = io_uring.io_uring_enter
+            while submitted_count < block_count:
+                chunk = block_list[
+                    submitted_count:submitted_count + sq_entries
+                ]
+                sq_tail.value = writeSQEs(chunk, sq_tail.value)
+                try:
+                    consumed = io_uring_enter(
+                        ring_fd,
+                        len(chunk),
+                        0,
+                        0,
+                        None,
+                        0,
+                    )
+                finally:
+                    # Withdraw entries the kernel did not consume.
+                    sq_tail.value = self._sq_head.value
+                submitted_count += consumed
+                if consumed < len(chunk):
+                    break
+        finally:
+            # Remove any non-submitted transfer
+            submitted = self._submitted
+            for block in block_list[submitted_count:]:
+                submitted.pop(id(block), None)
+        return submitted_count
+
+    def _submitSQPoll(self, block_list):
+        # The kernel thread consumes entries on its own: they cannot be
+        # withdrawn, and the kernel only needs to be called to wake the thread
+        # up, or to wait for free entries.
+        submitted_count = 0
+        try:
+            block_count = len(block_list)
+            ring_fd = self._ring_fd
+            sq_entries = self._sq_entries
+            sq_head = self._sq_head
+            sq_tail = self._sq_tail
+            sq_flags = self._sq_flags
+            new_tail = self._sq_new_tail
+            new_tail_address = addressof(new_tail)
+            sq_tail_address = addressof(sq_tail)
+            writeSQEs = self._writeSQEs
+            io_uring_enter = io_uring.io_uring_enter
+            while submitted_count < block_count:
+                tail = sq_tail.value
+                free = sq_entries - ((tail - sq_head.value) & 0xffffffff)
+                if not free:
+                    io_uring_enter(
+                        ring_fd,
+                        0,
+                        0,
+                        io_uring.IORING_ENTER_SQ_WAKEUP |
+                        io_uring.IORING_ENTER_SQ_WAIT,
+                        None,
+                        0,
+                    )
+                    continue
+                chunk = block_list[submitted_count:submitted_count + free]
+                new_tail.value = writeSQEs(chunk, tail)
+                # Publish the new tail with a foreign call: ctypes releases
+                # and re-acquires the GIL around it, which is a full memory
+                # barrier. Without it, sq_flags could be read before the kernel
+                # thread can see the tail, and miss that it went to sleep.
+                memmove(sq_tail_address, new_tail_address, 4)
+                submitted_count += len(chunk)
+                if sq_flags.value & io_uring.IORING_SQ_NEED_WAKEUP:
+                    io_uring_enter(
+                        ring_fd,
+                        0,
+                        0,
+                        io_uring.IORING_ENTER_SQ_WAKEUP,
+                        None,
+                        0,
+                    )
+        finally:
+            # Remove any non-submitted transfer
+            submitted = self._submitted
+            for block in block_list[submitted_count:]:
+                submitted.pop(id(block), None)
+        return submitted_count
+
+    def _waitSQPoll(self):
+        """
+        For internal use only.
+        """
+        # With sqpoll, submitted blocks may not have been picked up by the
+        # kernel thread yet, and cannot be cancelled until then: wait for it.
+        if self._sqpoll:
+            sq_head = self._sq_head
+            sq_tail = self._sq_tail
+            while sq_head.value != sq_tail.value:
+                io_uring.io_uring_enter(
+                    self._ring_fd,
+                    0,
+                    0,
+                    io_uring.IORING_ENTER_SQ_WAKEUP,
+                    None,
+                    0,
+                )
+
+    def _writeSQEs(self, block_list, tail):
+        """
+        For internal use only.
+        """
+        # Writes one submission queue entry per block, starting at tail.
+        # Returns the new tail.
+        sq_mask = self._sq_mask
+        sqe_map = self._sqe_map
+        packSQE = _packSQE
+        unpackIOCB = _unpackIOCB
+        getFixedFile = self._fixed_file_dict.get
+        fixed_buffer_base_list = self._fixed_buffer_base_list
+        fixed_buffer_list = self._fixed_buffer_list
+        iopoll = self._iopoll
+        for block in block_list:
+            (
+                rw_flags, opcode, reqprio, fildes, buf, nbytes, offset, flags,
+            # pylint: disable=protected-access
+            ) = unpackIOCB(block._iocb)
+            # pylint: enable=protected-access
+            if flags & libaio.IOCB_FLAG_RESFD:
+                raise ValueError(
+                    'eventfd is not supported: %r' % (block, ),
+                )
+            if iopoll and opcode not in _IOPOLL_OPCODE_SET:
+                raise ValueError(
+                    'iopoll only supports reads and writes: %r' % (block, ),
+                )
+            sqe_flags = 0
+            buf_index = 0
+            fixed_file = getFixedFile(fildes)
+            if fixed_file is not None:
+                sqe_flags = io_uring.IOSQE_FIXED_FILE
+                fildes = fixed_file
+            if (
+                opcode == libaio.IO_CMD_PREAD or
+                opcode == libaio.IO_CMD_PWRITE
+            ):
+                is_read = opcode == libaio.IO_CMD_PREAD
+                opcode = (
+                    io_uring.IORING_OP_READ
+                    if is_read else
+                    io_uring.IORING_OP_WRITE
+                )
+                if fixed_buffer_base_list:
+                    position = bisect_right(fixed_buffer_base_list, buf) - 1
+                    if position >= 0:
+                        end, index, _ = fixed_buffer_list[position]
+                        if buf + nbytes <= end:
+                            opcode = (
+                                io_uring.IORING_OP_READ_FIXED
+                                if is_read else
+                                io_uring.IORING_OP_WRITE_FIXED
+                            )
+                            buf_index = index
+            elif opcode == libaio.IO_CMD_PREADV:
+                opcode = io_uring.IORING_OP_READV
+            elif opcode == libaio.IO_CMD_PWRITEV:
+                opcode = io_uring.IORING_OP_WRITEV
+            else:
+                if opcode == libaio.IO_CMD_POLL:
+                    opcode = io_uring.IORING_OP_POLL_ADD
+                    # Stored as buf by AIOBlock.event_mask .
+                    rw_flags = io_uring.io_uring_poll_mask(buf)
+                else:
+                    rw_flags = (
+                        io_uring.IORING_FSYNC_DATASYNC
+                        if opcode == libaio.IO_CMD_FDSYNC else
+                        0
+                    )
+                    opcode = io_uring.IORING_OP_FSYNC
+                offset = buf = nbytes = 0
+            packSQE(
+                sqe_map,
+                (tail & sq_mask) * _SQE_SIZE,
+                opcode,
+                sqe_flags,
+                reqprio,
+                fildes,
+                offset,
+                buf,
+                nbytes,
+                # rw_flags, poll32_events or fsync_flags
+                rw_flags,
+                id(block),
+                buf_index,
+            )
+            tail += 1
+        return tail
+
+    def cancel(self, block):
+        """
+        Cancel an IO block.
+
+        block (AIOBlock)
+            The IO block to cancel.
+
+        Always returns None: event completion will happen on a later
+        getEvents call. Waits for the block to complete if it cannot be
+        cancelled.
+
+        Deferred blocks are submitted first.
+        """
+        self.flush()
+        self._waitSQPoll()
+        cancel_reg = self._cancel_reg
+        cancel_reg.addr = id(block)
+        try:
+            io_uring.io_uring_register(
+                self._ring_fd,
+                io_uring.IORING_REGISTER_SYNC_CANCEL,
+                byref(cancel_reg),
+                1,
+            )
+        except OSError as exc:
+            if exc.errno == errno.ENOENT:
+                # Same as io_cancel on a not-in-flight block.
+                raise OSError(errno.EINVAL, exc.strerror)
+            raise
+
+    def registerFiles(self, file_list):
+        """
+        Register files with the kernel, to spare it from looking up their
+        file descriptor on every operation.
+
+        file_list (list of file-ish or int)
+            Files which will be the target_file of submitted blocks.
+            Replaces any previously registered file list.
+
+        Blocks are matched by file descriptor number when submitted:
+        unregister files before closing them.
+        """
+        self.unregisterFiles()
+        fd_list = [
+            x if isinstance(x, int) else x.fileno()
+            for x in file_list
         ]
+        if fd_list:
+            io_uring.io_uring_register(
+                self._ring_fd,
+                io_uring.IORING_REGISTER_FILES,
+                (c_int32 * len(fd_list))(*fd_list),
+                len(fd_list),
+            )
+            self._fixed_file_dict = {
+                fd: index
+                for index, fd in enumerate(fd_list)
+            }
+
+    def unregisterFiles(self):
+        """
+        Unregister files registered with registerFiles.
+        """
+        if self._fixed_file_dict:
+            io_uring.io_uring_register(
+                self._ring_fd,
+                io_uring.IORING_UNREGISTER_FILES,
+                None,
+                0,
+            )
+            self._fixed_file_dict = {}
+
+    def registerBuffers(self, buffer_list):
+        """
+        Register buffers with the kernel, so their pages are pinned once
+        rather than on every operation.
+
+        buffer_list (list of mutable buffer instances: mmap, bytearray, ...)
+            Memory areas containing the buffers of submitted blocks.
+            Replaces any previously registered buffer list.
+            Subject to RLIMIT_MEMLOCK.
+
+        Read and write blocks with a single buffer lying within a registered
+        buffer use it. Other blocks are submitted as usual.
+        """
+        self.unregisterBuffers()
+        fixed_buffer_list = []
+        for index, buf in enumerate(buffer_list):
+            # Keep a reference to the exported buffer, so it is not freed nor
+            # resized while registered.
+            c_buf = c_char.from_buffer(buf)
+            fixed_buffer_list.append((
+                addressof(c_buf),
+                memoryview(buf).nbytes,
+                index,
+                c_buf,
+            ))
+        if fixed_buffer_list:
+            io_uring.io_uring_register(
+                self._ring_fd,
+                io_uring.IORING_REGISTER_BUFFERS,
+                (libaio.iovec * len(fixed_buffer_list))(*[
+                    (base, length)
+                    for base, length, _, _ in fixed_buffer_list
+                ]),
+                len(fixed_buffer_list),
+            )
+            fixed_buffer_list.sort(key=lambda x: x[0])
+            self._fixed_buffer_base_list = [
+                base
+                for base, _, _, _ in fixed_buffer_list
+            ]
+            self._fixed_buffer_list = [
+                (base + length, index, c_buf)
+                for base, length, index, c_buf in fixed_buffer_list
+            ]
+
+    def unregisterBuffers(self):
+        """
+        Unregister buffers registered with registerBuffers.
+        """
+        if self._fixed_buffer_list:
+            io_uring.io_uring_register(
+                self._ring_fd,
+                io_uring.IORING_UNREGISTER_BUFFERS,
+                None,
+                0,
+            )
+            self._fixed_buffer_base_list = []
+            self._fixed_buffer_list = []
+
+    def _eventListToPython(self, event_data):
+        pop = self._submitted.pop
+        result = []
+        append = result.append
+        for user_data, res in self._unpackEventList(event_data):
+            aio_block, _ = pop(user_data)
+            aio_block.onCompletion(aio_block, res, 0)
+            append((aio_block, res, 0))
+        return result
+
+    def _storeEventList(self, event_array, event_data):
+        pop = self._submitted.pop
+        value_list = []
+        extend = value_list.extend
+        for user_data, res in self._unpackEventList(event_data):
+            pop(user_data)
+            extend((user_data, res, 0))
+        pack_into('=%iq' % len(value_list), event_array, 0, *value_list)
+        return len(value_list) // 3
+
+    def _processEventList(self, event_data):
+        pop = self._submitted.pop
+        for user_data, res in self._unpackEventList(event_data):
+            aio_block, _ = pop(user_data)
+            aio_block.onCompletion(aio_block, res, 0)
+        return len(event_data) // self._EVENT_SIZE
+
+    def _fetchEvents(self, min_nr, nr, timeout, event_buffer):
+        """
+        For internal use only.
+        """
+        cq_head = self._cq_head
+        cq_tail = self._cq_tail
+        head = cq_head.value
+        available = (cq_tail.value - head) & 0xffffffff
+        wait = available < min_nr and (timeout is None or timeout > 0)
+        if self._iopoll and available < nr:
+            # Completions only reach the ring when the kernel is asked to poll
+            # for them, and it then ignores any timeout: only let it spin
+            # for min_nr events when there is no timeout. It may return early,
+            # so check what it actually found.
+            if wait and timeout is None:
+                poll_min_nr = min_nr
+                deadline = None
+            else:
+                poll_min_nr = 0
+                deadline = monotonic() + (timeout if wait else 0)
+            while True:
+                io_uring.io_uring_enter(
+                    self._ring_fd,
+                    0,
+                    poll_min_nr,
+                    io_uring.IORING_ENTER_GETEVENTS,
+                    None,
+                    0,
+                )
+                available = (cq_tail.value - head) & 0xffffffff
+                if available >= min_nr or (
+                    deadline is not None and monotonic() >= deadline
+                ):
+                    break
+            wait = False
+        if wait or self._sq_flags.value & io_uring.IORING_SQ_CQ_OVERFLOW:
+            # Wait for events if needed, and move to the ring any event the
+            # kernel had to keep aside because the ring was full.
+            arg = None
+            arg_size = 0
+            flags = io_uring.IORING_ENTER_GETEVENTS
+            if not wait:
+                min_nr = 0
+            elif timeout is not None:
+                sec = int(timeout)
+                timespec = self._timeout
+                timespec.tv_sec = sec
+                timespec.tv_nsec = int((timeout - sec) * 1e9)
+                arg = self._getevents_arg_p
+                arg_size = self._GETEVENTS_ARG_SIZE
+                flags |= io_uring.IORING_ENTER_EXT_ARG
+            try:
+                io_uring.io_uring_enter(
+                    self._ring_fd,
+                    0,
+                    min_nr,
+                    flags,
+                    arg,
+                    arg_size,
+                )
+            except OSError as exc:
+                if exc.errno != errno.ETIME:
+                    raise
+            available = (cq_tail.value - head) & 0xffffffff
+        count = min(available, nr)
+        if count:
+            cqe_size = self._EVENT_SIZE
+            index = head & self._cq_mask
+            first_count = min(count, self._cq_entries - index)
+            buffer_address = addressof(event_buffer)
+            cqes_address = self._cqes_address
+            memmove(
+                buffer_address,
+                cqes_address + index * cqe_size,
+                first_count * cqe_size,
+            )
+            if count > first_count:
+                memmove(
+                    buffer_address + first_count * cqe_size,
+                    cqes_address,
+                    (count - first_count) * cqe_size,
+                )
+            cq_head.value = head + count
+        return count
+
+CONTEXT_CLASS_DICT = {
+    'aio': AIOContext,
+    'io_uring': IOUringContext,
+}
+
+def getContextClass(backend=None):
+    """
+    Returns the context class of given backend.
+
+    backend (str, None)
+        One of CONTEXT_CLASS_DICT keys.
+        If None, the LIBAIO_BACKEND environment variable is used, and 'aio' if
+        it is not set.
+    """
+    if backend is None:
+        backend = os.environ.get('LIBAIO_BACKEND') or 'aio'
+    try:
+        return CONTEXT_CLASS_DICT[backend]
+    except KeyError:
+        raise ValueError(
+            'Unknown backend %r, expected one of: %s' % (
+                backend,
+                ', '.join(sorted(CONTEXT_CLASS_DICT)),
+            ),
+        ) from None
+
+def __getattr__(name):
+    # Context is the class selected by the LIBAIO_BACKEND environment
+    # variable, so applications using it can switch backend without code
+    # change. Resolved when used, so an invalid value does not prevent
+    # importing this module.
+    if name == 'Context':
+        return getContextClass()
+    raise AttributeError(
+        'module %r has no attribute %r' % (__name__, name),
+    )
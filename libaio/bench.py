@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright (C) 2026  Vincent Pelletier <plr.vincent@gmail.com>
+#
+# This file is part of python-libaio.
+# python-libaio is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# python-libaio is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with python-libaio.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Queue depth benchmark.
+
+Reads blocks from a file while keeping a given number of them in flight, and
+prints the achieved rate. Not part of the test suite.
+
+Usage: python -m libaio.bench --help
+"""
+import argparse
+from mmap import mmap
+import os
+import time
+import libaio
+
+def bench(fd, context_class, depth, size, count):
+    """
+    Read count blocks of size bytes from fd, keeping depth blocks in flight.
+
+    Consecutive blocks are read from consecutive offsets, wrapping around at
+    the end of the file. Files with no size (ex: character devices) are always
+    read from offset 0.
+
+    Returns the elapsed time in nanoseconds, and the number of blocks which
+    did not complete with the requested size.
+    """
+    file_size = os.fstat(fd).st_size
+    if file_size:
+        file_size -= file_size % size
+        if not file_size:
+            raise ValueError('file is smaller than one block')
+    free_block_list = []
+    error_list = []
+    def onCompletion(block, res, res2):
+        """
+        Make the block available for reuse, remembering short reads.
+        """
+        # pylint: disable=unused-argument
+        if res != size:
+            error_list.append(res)
+        free_block_list.append(block)
+    for _ in range(depth):
+        free_block_list.append(
+            libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=fd,
+                # Page-aligned, as required by O_DIRECT.
+                buffer_list=[mmap(-1, size)],
+                onCompletion=onCompletion,
+            ),
+        )
+    def iterBlocks():
+        """
+        Produce count blocks, reusing completed ones.
+        """
+        pop = free_block_list.pop
+        for index in range(count):
+            block = pop()
+            if file_size:
+                block.offset = index * size % file_size
+            yield block
+    with context_class(depth) as io_context:
+        start = time.perf_counter_ns()
+        io_context.run(iterBlocks(), depth)
+        elapsed = time.perf_counter_ns() - start
+    return elapsed, len(error_list)
+
+def main():
+    """
+    Command-line entry point.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument(
+        '--backend',
+        choices=sorted(libaio.CONTEXT_CLASS_DICT),
+        default=os.environ.get('LIBAIO_BACKEND') or 'aio',
+        help='Context class to use (default: %(default)s, from '
+        'LIBAIO_BACKEND).',
+    )
+    parser.add_argument(
+        '--depth',
+        type=int,
+        default=32,
+        help='Number of blocks kept in flight (default: %(default)s).',
+    )
+    parser.add_argument(
+        '--iosize',
+        type=int,
+        default=4096,
+        help='Size of each block, in bytes (default: %(default)s).',
+    )
+    parser.add_argument(
+        '--count',
+        type=int,
+        default=100000,
+        help='Number of blocks to read (default: %(default)s).',
+    )
+    parser.add_argument(
+        '--direct',
+        action='store_true',
+        help='Open the file with O_DIRECT.',
+    )
+    parser.add_argument(
+        'file',
+        nargs='?',
+        default='/dev/zero',
+        help='File to read from (default: %(default)s).',
+    )
+    args = parser.parse_args()
+    fd = os.open(args.file, os.O_RDONLY | (os.O_DIRECT if args.direct else 0))
+    try:
+        elapsed, error_count = bench(
+            fd=fd,
+            context_class=libaio.getContextClass(args.backend),
+            depth=args.depth,
+            size=args.iosize,
+            count=args.count,
+        )
+    finally:
+        os.close(fd)
+    print(
+        '%s depth=%i iosize=%i count=%i: %.0f IOPS, %.2f us/op, %i errors' % (
+            args.backend,
+            args.depth,
+            args.iosize,
+            args.count,
+            args.count * 1e9 / elapsed,
+            elapsed / 1e3 / args.count,
+            error_count,
+        ),
+    )
+
+if __name__ == '__main__':
+    main()
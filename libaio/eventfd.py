@@ -19,6 +19,7 @@ Minimal adaptation of sys/eventfd.h and bits/eventfd.h .
 from ctypes import CDLL, c_uint, c_int, get_errno
 from ctypes.util import find_library
 import os
+from struct import Struct
 
 libc = CDLL(find_library("c"), use_errno=True)
 # pylint: disable=unused-argument
@@ -28,10 +29,27 @@ def _raise_errno_on_neg_one(result, func, arguments):
     return result
 # pylint: enable=unused-argument
 
-eventfd = libc.eventfd
-eventfd.restype = c_int
-eventfd.argtypes = (c_int, c_uint)
-eventfd.errcheck = _raise_errno_on_neg_one
+try:
+    # pylint: disable=no-name-in-module
+    from os import eventfd, eventfd_read, eventfd_write
+    # pylint: enable=no-name-in-module
+except ImportError:
+    # BBB: python < 3.10
+    eventfd = libc.eventfd
+    eventfd.restype = c_int
+    eventfd.argtypes = (c_int, c_uint)
+    eventfd.errcheck = _raise_errno_on_neg_one
+
+    # eventfd counter, read and written as a native-endian 8 bytes integer.
+    _EVENTFD_COUNTER = Struct('Q')
+    _packCounter = _EVENTFD_COUNTER.pack
+    _unpackCounter = _EVENTFD_COUNTER.unpack
+
+    def eventfd_read(fd):
+        return _unpackCounter(os.read(fd, 8))[0]
+
+    def eventfd_write(fd, value):
+        os.write(fd, _packCounter(value))
 
 EFD_SEMAPHORE = 0o00000001
 # Note: the glibc hardcodes those EFD_ constants, duplicating their O_
@@ -0,0 +1,238 @@
+# Copyright (C) 2026  Vincent Pelletier <plr.vincent@gmail.com>
+#
+# This file is part of python-libaio.
+# python-libaio is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# python-libaio is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with python-libaio.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Minimal adaptation of linux/io_uring.h and io_uring syscalls.
+
+liburing implements most of its API as inline functions, so it cannot be
+used through ctypes: the syscalls are called directly instead.
+"""
+from ctypes import (
+    POINTER, Structure, Union, c_int, c_int32, c_int64, c_long, c_uint,
+    c_uint8, c_uint16, c_uint32, c_uint64, c_void_p,
+)
+from functools import partial
+import sys
+from .eventfd import libc, _raise_errno_on_neg_one
+# pylint: disable=missing-docstring
+
+# asm-generic numbers, used by all architectures but alpha and mips, which
+# IOUringContext refuses.
+__NR_io_uring_setup = 425
+__NR_io_uring_enter = 426
+__NR_io_uring_register = 427
+
+class kernel_timespec(Structure):
+    _fields_ = [
+        ('tv_sec', c_int64),
+        ('tv_nsec', c_int64),
+    ]
+
+class _io_uring_sqe_op_flags(Union):
+    _fields_ = [
+        ('rw_flags', c_uint32),
+        ('fsync_flags', c_uint32),
+        ('poll32_events', c_uint32),
+        ('cancel_flags', c_uint32),
+    ]
+
+class io_uring_sqe(Structure):
+    _anonymous_ = ('_op_flags', )
+    _fields_ = [
+        ('opcode', c_uint8),
+        ('flags', c_uint8),
+        ('ioprio', c_uint16),
+        ('fd', c_int32),
+        ('off', c_uint64),
+        ('addr', c_uint64),
+        ('len', c_uint32),
+        ('_op_flags', _io_uring_sqe_op_flags),
+        ('user_data', c_uint64),
+        ('buf_index', c_uint16),
+        ('personality', c_uint16),
+        ('file_index', c_int32),
+        ('addr3', c_uint64),
+        ('__pad2', c_uint64),
+    ]
+
+del _io_uring_sqe_op_flags
+
+class io_uring_cqe(Structure):
+    _fields_ = [
+        ('user_data', c_uint64),
+        ('res', c_int32),
+        ('flags', c_uint32),
+    ]
+
+class io_sqring_offsets(Structure):
+    _fields_ = [
+        ('head', c_uint32),
+        ('tail', c_uint32),
+        ('ring_mask', c_uint32),
+        ('ring_entries', c_uint32),
+        ('flags', c_uint32),
+        ('dropped', c_uint32),
+        ('array', c_uint32),
+        ('resv1', c_uint32),
+        ('user_addr', c_uint64),
+    ]
+
+class io_cqring_offsets(Structure):
+    _fields_ = [
+        ('head', c_uint32),
+        ('tail', c_uint32),
+        ('ring_mask', c_uint32),
+        ('ring_entries', c_uint32),
+        ('overflow', c_uint32),
+        ('cqes', c_uint32),
+        ('flags', c_uint32),
+        ('resv1', c_uint32),
+        ('user_addr', c_uint64),
+    ]
+
+class io_uring_params(Structure):
+    _fields_ = [
+        ('sq_entries', c_uint32),
+        ('cq_entries', c_uint32),
+        ('flags', c_uint32),
+        ('sq_thread_cpu', c_uint32),
+        ('sq_thread_idle', c_uint32),
+        ('features', c_uint32),
+        ('wq_fd', c_uint32),
+        ('resv', c_uint32 * 3),
+        ('sq_off', io_sqring_offsets),
+        ('cq_off', io_cqring_offsets),
+    ]
+
+class io_uring_getevents_arg(Structure):
+    _fields_ = [
+        ('sigmask', c_uint64),
+        ('sigmask_sz', c_uint32),
+        ('min_wait_usec', c_uint32),
+        ('ts', c_uint64),
+    ]
+
+class io_uring_sync_cancel_reg(Structure):
+    _fields_ = [
+        ('addr', c_uint64),
+        ('fd', c_int32),
+        ('flags', c_uint32),
+        ('timeout', kernel_timespec),
+        ('opcode', c_uint8),
+        ('pad', c_uint8 * 7),
+        ('pad2', c_uint64 * 3),
+    ]
+
+# io_uring_setup flags
+IORING_SETUP_IOPOLL = 1 << 0
+IORING_SETUP_SQPOLL = 1 << 1
+IORING_SETUP_SQ_AFF = 1 << 2
+IORING_SETUP_CQSIZE = 1 << 3
+IORING_SETUP_CLAMP = 1 << 4
+
+# io_uring_op
+IORING_OP_NOP = 0
+IORING_OP_READV = 1
+IORING_OP_WRITEV = 2
+IORING_OP_FSYNC = 3
+IORING_OP_READ_FIXED = 4
+IORING_OP_WRITE_FIXED = 5
+IORING_OP_POLL_ADD = 6
+IORING_OP_POLL_REMOVE = 7
+IORING_OP_ASYNC_CANCEL = 14
+IORING_OP_READ = 22
+IORING_OP_WRITE = 23
+
+# io_uring_sqe.flags
+IOSQE_FIXED_FILE = 1 << 0
+IOSQE_IO_DRAIN = 1 << 1
+IOSQE_IO_LINK = 1 << 2
+
+# io_uring_sqe.fsync_flags
+IORING_FSYNC_DATASYNC = 1 << 0
+
+# mmap offsets
+IORING_OFF_SQ_RING = 0
+IORING_OFF_CQ_RING = 0x8000000
+IORING_OFF_SQES = 0x10000000
+
+# sq_ring.flags
+IORING_SQ_NEED_WAKEUP = 1 << 0
+IORING_SQ_CQ_OVERFLOW = 1 << 1
+
+# io_uring_enter flags
+IORING_ENTER_GETEVENTS = 1 << 0
+IORING_ENTER_SQ_WAKEUP = 1 << 1
+IORING_ENTER_SQ_WAIT = 1 << 2
+IORING_ENTER_EXT_ARG = 1 << 3
+
+# io_uring_params.features
+IORING_FEAT_SINGLE_MMAP = 1 << 0
+IORING_FEAT_NODROP = 1 << 1
+IORING_FEAT_EXT_ARG = 1 << 8
+
+# io_uring_register opcodes
+IORING_REGISTER_BUFFERS = 0
+IORING_UNREGISTER_BUFFERS = 1
+IORING_REGISTER_FILES = 2
+IORING_UNREGISTER_FILES = 3
+IORING_REGISTER_EVENTFD = 4
+IORING_UNREGISTER_EVENTFD = 5
+IORING_REGISTER_SYNC_CANCEL = 24
+
+def _syscall(name, number, *args):
+    # Each indexing creates a new function object, so its signature can be
+    # set independently of other syscall bindings.
+    result = libc['syscall']
+    result.__name__ = name
+    result.restype = c_int
+    result.argtypes = (c_long, ) + args
+    result.errcheck = _raise_errno_on_neg_one
+    return partial(result, number)
+
+io_uring_setup = _syscall(
+    'io_uring_setup',
+    __NR_io_uring_setup,
+    c_uint,
+    POINTER(io_uring_params),
+)
+io_uring_enter = _syscall(
+    'io_uring_enter',
+    __NR_io_uring_enter,
+    c_int,
+    c_uint,
+    c_uint,
+    c_uint,
+    c_void_p,
+    c_long,
+)
+io_uring_register = _syscall(
+    'io_uring_register',
+    __NR_io_uring_register,
+    c_int,
+    c_uint,
+    c_void_p,
+    c_uint,
+)
+
+if sys.byteorder == 'big':
+    # The kernel swaps 16 bits halves of poll32_events on big-endian hosts,
+    # for compatibility with the older 16 bits poll_events field.
+    def io_uring_poll_mask(poll_mask):
+        return ((poll_mask & 0xffff) << 16) | (poll_mask >> 16)
+else:
+    def io_uring_poll_mask(poll_mask):
+        return poll_mask
+# pylint: enable=missing-docstring
@@ -21,7 +21,13 @@ __all__ = (
     'IOPRIO_CLASS_RT', 'IOPRIO_CLASS_BE', 'IOPRIO_CLASS_IDLE',
 )
 IOPRIO_CLASS_SHIFT = 13
-IOPRIO_PRIO_VALUE = lambda klass, data: (klass << IOPRIO_CLASS_SHIFT) | data
+
+def IOPRIO_PRIO_VALUE(klass, data):
+    """
+    Combine an io priority class and its class-specific data into a value
+    suitable for AIOBlock's io_priority.
+    """
+    return (klass << IOPRIO_CLASS_SHIFT) | data
 
 IOPRIO_CLASS_RT = 1
 IOPRIO_CLASS_BE = 2
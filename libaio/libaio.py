@@ -17,11 +17,13 @@
 Adaptation of libaio.h .
 """
 from ctypes import (
-    CDLL, CFUNCTYPE, POINTER, Union, Structure, memset, sizeof, byref, c_long,
-    c_size_t, c_int64, c_short, c_int, c_uint, c_ulong, c_void_p, c_longlong,
-    cast,
+    CDLL, CFUNCTYPE, POINTER, Array, Union, Structure, memset, memmove,
+    sizeof, byref, addressof, c_long, c_size_t, c_int64, c_short, c_int,
+    c_uint, c_ulong, c_void_p, c_longlong, cast,
 )
+from struct import pack_into
 import sys
+import threading
 # pylint: disable=missing-docstring
 
 class timespec(Structure):
@@ -56,32 +58,41 @@ IO_CMD_NOOP = 6
 IO_CMD_PREADV = 7
 IO_CMD_PWRITEV = 8
 
-PADDED, PADDEDptr, PADDEDul, PADDEDl = {
-    (4, 'little'): (
-        lambda w, x, y: [(x, w), (y, c_uint)],
-        lambda w, x, y: [(x, w), (y, c_uint)],
-        lambda    x, y: [(x, c_ulong), (y, c_uint)],
-        lambda    x, y: [(x, c_long), (y, c_uint)],
-    ),
-    (8, 'little'): (
-        lambda w, x, y: [(x, w), (y, w)],
-        lambda w, x, _: [(x, w)],
-        lambda    x, _: [(x, c_ulong)],
-        lambda    x, _: [(x, c_long)],
-    ),
-    (8, 'big'): (
-        lambda w, x, y: [(y, c_uint), (x, w)],
-        lambda w, x, _: [(x, w)],
-        lambda    x, _: [(x, c_ulong)],
-        lambda    x, _: [(x, c_long)],
-    ),
-    (4, 'big'): (
-        lambda w, x, y: [(y, c_uint), (x, w)],
-        lambda w, x, y: [(y, c_uint), (x, w)],
-        lambda    x, y: [(y, c_uint), (x, c_ulong)],
-        lambda    x, y: [(y, c_uint), (x, c_long)],
-    ),
-}[(sizeof(c_ulong), sys.byteorder)]
+# Padding helpers, only used while declaring structures below.
+# pylint: disable=invalid-name, function-redefined, unused-argument
+_LONG_IS_64 = sizeof(c_ulong) == 8
+if sys.byteorder == 'big':
+    def PADDED(w, x, y):
+        return [(y, c_uint), (x, w)]
+elif _LONG_IS_64:
+    def PADDED(w, x, y):
+        return [(x, w), (y, w)]
+else:
+    def PADDED(w, x, y):
+        return [(x, w), (y, c_uint)]
+if _LONG_IS_64:
+    def PADDEDptr(w, x, y):
+        return [(x, w)]
+    def PADDEDul(x, y):
+        return [(x, c_ulong)]
+    def PADDEDl(x, y):
+        return [(x, c_long)]
+elif sys.byteorder == 'little':
+    def PADDEDptr(w, x, y):
+        return [(x, w), (y, c_uint)]
+    def PADDEDul(x, y):
+        return [(x, c_ulong), (y, c_uint)]
+    def PADDEDl(x, y):
+        return [(x, c_long), (y, c_uint)]
+else:
+    def PADDEDptr(w, x, y):
+        return [(y, c_uint), (x, w)]
+    def PADDEDul(x, y):
+        return [(y, c_uint), (x, c_ulong)]
+    def PADDEDl(x, y):
+        return [(y, c_uint), (x, c_long)]
+del _LONG_IS_64
+# pylint: enable=invalid-name, function-redefined, unused-argument
 
 class io_iocb_poll(Structure):
     _fields_ = PADDED(c_int, 'events', '__pad1')
@@ -146,6 +157,23 @@ class io_event(Structure):
     )
 io_event_p = POINTER(io_event)
 
+# Not part of libaio.h: header of the completion ring shared by the kernel,
+# which io_context_t points to (fs/aio.c).
+class aio_ring(Structure):
+    _fields_ = [
+        ('id', c_uint),
+        ('nr', c_uint),
+        ('head', c_uint),
+        ('tail', c_uint),
+        ('magic', c_uint),
+        ('compat_features', c_uint),
+        ('incompat_features', c_uint),
+        ('header_length', c_uint),
+    ]
+
+AIO_RING_MAGIC = 0xa10a10a1
+AIO_RING_INCOMPAT_FEATURES = 0
+
 del PADDED, PADDEDptr, PADDEDul, PADDEDl
 
 io_callback_t = CFUNCTYPE(None, io_context_t, iocb_p, c_long, c_long)
@@ -158,10 +186,16 @@ def _raise_on_negative(result, func, arguments):
     return result
 # pylint: enable=unused-argument
 
-def _func(name, *args):
-    result = getattr(libaio, name)
+def _raw_func(name, *args):
+    # Indexing returns a new function object each time, so checked and
+    # unchecked bindings of the same function can coexist.
+    result = libaio[name]
     result.restype = c_int
     result.argtypes = args
+    return result
+
+def _func(name, *args):
+    result = _raw_func(name, *args)
     result.errcheck = _raise_on_negative
     return result
 
@@ -180,6 +214,23 @@ io_getevents = _func(
     io_event_p,
     POINTER(timespec),
 )
+# Unchecked variants, returning -errno instead of raising: callers check the
+# result themselves, saving one python call per use.
+io_submit_raw = _raw_func('io_submit', *io_submit.argtypes)
+io_getevents_raw = _raw_func('io_getevents', *io_getevents.argtypes)
+
+_single_iocb_p = threading.local()
+
+def _submit_one(ctx, iocb):
+    # Reuse a per-thread 1-entry pointer array instead of allocating one per
+    # call. Per-thread because the GIL is released during io_submit.
+    try:
+        iocb_p_array = _single_iocb_p.array
+    except AttributeError:
+        iocb_p_array = _single_iocb_p.array = (iocb_p * 1)()
+    # Write the address directly, rather than through a pointer object.
+    pack_into('P', iocb_p_array, 0, addressof(iocb))
+    return io_submit(ctx, 1, iocb_p_array)
 
 # pylint: disable=redefined-outer-name, too-many-arguments
 def io_set_callback(iocb, cb):
@@ -188,8 +239,15 @@ def io_set_callback(iocb, cb):
 def zero(struct):
     memset(byref(struct), 0, sizeof(struct))
 
+_IOCB_SIZE = sizeof(iocb)
+_ZERO_IOCB = b'\x00' * _IOCB_SIZE
+
+def _zero_iocb(iocb):
+    # Cheaper than zero(): no byref object, no sizeof call.
+    memmove(addressof(iocb), _ZERO_IOCB, _IOCB_SIZE)
+
 def _io_prep_prw(opcode, iocb, fd, buf, count, offset, flags=0):
-    zero(iocb)
+    _zero_iocb(iocb)
     iocb.aio_fildes = fd
     iocb.aio_lio_opcode = opcode
     iocb.aio_reqprio = 0
@@ -198,6 +256,10 @@ def _io_prep_prw(opcode, iocb, fd, buf, count, offset, flags=0):
     iocb.u.c.nbytes = count
     iocb.u.c.offset = offset
 
+def _iov_address(iov):
+    # addressof is much cheaper than cast, but only applies to arrays.
+    return addressof(iov) if isinstance(iov, Array) else cast(iov, c_void_p)
+
 def io_prep_pread(iocb, fd, buf, count, offset):
     _io_prep_prw(IO_CMD_PREAD, iocb, fd, buf, count, offset)
 
@@ -205,31 +267,31 @@ def io_prep_pwrite(iocb, fd, buf, count, offset):
     _io_prep_prw(IO_CMD_PWRITE, iocb, fd, buf, count, offset)
 
 def io_prep_preadv(iocb, fd, iov, iovcnt, offset):
-    _io_prep_prw(IO_CMD_PREADV, iocb, fd, cast(iov, c_void_p), iovcnt, offset)
+    _io_prep_prw(IO_CMD_PREADV, iocb, fd, _iov_address(iov), iovcnt, offset)
 
 def io_prep_pwritev(iocb, fd, iov, iovcnt, offset):
-    _io_prep_prw(IO_CMD_PWRITEV, iocb, fd, cast(iov, c_void_p), iovcnt, offset)
+    _io_prep_prw(IO_CMD_PWRITEV, iocb, fd, _iov_address(iov), iovcnt, offset)
 
 def io_prep_preadv2(iocb, fd, iov, iovcnt, offset, flags):
-    _io_prep_prw(IO_CMD_PREADV, iocb, fd, cast(iov, c_void_p), iovcnt, offset, flags)
+    _io_prep_prw(IO_CMD_PREADV, iocb, fd, _iov_address(iov), iovcnt, offset, flags)
 
 def io_prep_pwritev2(iocb, fd, iov, iovcnt, offset, flags):
-    _io_prep_prw(IO_CMD_PWRITEV, iocb, fd, cast(iov, c_void_p), iovcnt, offset, flags)
+    _io_prep_prw(IO_CMD_PWRITEV, iocb, fd, _iov_address(iov), iovcnt, offset, flags)
 
-def io_prep_poll(iocb, fb, events):
-    zero(iocb)
+def io_prep_poll(iocb, fd, events):
+    _zero_iocb(iocb)
     iocb.aio_fildes = fd
     iocb.aio_lio_opcode = IO_CMD_POLL
     iocb.aio_reqprio = 0
     iocb.u.poll.events = events
 
 def io_poll(ctx, iocb, cb, fd, events):
-    io_prep_poll(iocb, fb, events)
+    io_prep_poll(iocb, fd, events)
     io_set_callback(iocb, cb)
-    return io_submit(ctx, 1, iocb_pp(byref(iocb)))
+    return _submit_one(ctx, iocb)
 
 def io_prep_fsync(iocb, fd):
-    zero(iocb)
+    _zero_iocb(iocb)
     iocb.aio_fildes = fd
     iocb.aio_lio_opcode = IO_CMD_FSYNC
     iocb.aio_reqprio = 0
@@ -237,10 +299,10 @@ def io_prep_fsync(iocb, fd):
 def io_fsync(ctx, iocb, cb, fd):
     io_prep_fsync(iocb, fd)
     io_set_callback(iocb, cb)
-    return io_submit(ctx, 1, iocb_pp(byref(iocb)))
+    return _submit_one(ctx, iocb)
 
 def io_prep_fdsync(iocb, fd):
-    zero(iocb)
+    _zero_iocb(iocb)
     iocb.aio_fildes = fd
     iocb.aio_lio_opcode = IO_CMD_FDSYNC
     iocb.aio_reqprio = 0
@@ -248,7 +310,7 @@ def io_prep_fdsync(iocb, fd):
 def io_fdsync(ctx, iocb, cb, fd):
     io_prep_fdsync(iocb, fd)
     io_set_callback(iocb, cb)
-    return io_submit(ctx, 1, iocb_pp(byref(iocb)))
+    return _submit_one(ctx, iocb)
 
 IOCB_FLAG_RESFD = 1 << 0
 IOCB_FLAG_IOPRIO = 1 << 1
@@ -0,0 +1,30 @@
+# Copyright (C) 2026  Vincent Pelletier <plr.vincent@gmail.com>
+#
+# This file is part of python-libaio.
+# python-libaio is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# python-libaio is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with python-libaio.  If not, see <http://www.gnu.org/licenses/>.
+"""
+Minimal adaptation of sys/mman.h .
+"""
+from ctypes import c_int, c_size_t, c_void_p
+from .eventfd import libc, _raise_errno_on_neg_one
+
+mlock = libc.mlock
+mlock.restype = c_int
+mlock.argtypes = (c_void_p, c_size_t)
+mlock.errcheck = _raise_errno_on_neg_one
+
+munlock = libc.munlock
+munlock.restype = c_int
+munlock.argtypes = (c_void_p, c_size_t)
+munlock.errcheck = _raise_errno_on_neg_one
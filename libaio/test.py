@@ -17,27 +17,31 @@
 """
 Testing libaio.
 """
-from __future__ import absolute_import, print_function
+import ctypes
 import errno
+import functools
 from mmap import mmap
 import os
 import unittest
+from unittest import mock
 import select
 import tempfile
+import threading
 import libaio
 
-# BBB: <3.7
-RWF_NOWAIT = getattr(os, 'RWF_NOWAIT', 8)
-
 class LibAIOTests(unittest.TestCase):
     """
     Testing libaio.
     """
+    context_class = libaio.AIOContext
+    # Events reported for a readable pipe polled for EPOLLIN.
+    poll_readable_events = select.EPOLLIN | select.EPOLLRDNORM
+
     def testReadWrite(self):
         """
         Most baic functions: without these, libaio will not be of much use.
         """
-        with tempfile.TemporaryFile() as temp, libaio.AIOContext(1) as io_context:
+        with tempfile.TemporaryFile() as temp, self.context_class(1) as io_context:
             def readall():
                 """
                 Reread the whole tempfile.
@@ -78,8 +82,8 @@ class LibAIOTests(unittest.TestCase):
             read_block.io_priority = None
             self.assertEqual(read_block.io_priority, None)
             self.assertEqual(read_block.rw_flags, 0)
-            read_block.rw_flags = RWF_NOWAIT
-            self.assertEqual(read_block.rw_flags, RWF_NOWAIT)
+            read_block.rw_flags = os.RWF_NOWAIT
+            self.assertEqual(read_block.rw_flags, os.RWF_NOWAIT)
             read_block.rw_flags = 0
             self.assertEqual(read_block.rw_flags, 0)
             self.assertEqual(read_block.target_file, temp)
@@ -142,12 +146,455 @@ class LibAIOTests(unittest.TestCase):
             )
             self.assertEqual(readall(), b'bluez')
 
+    def testBufferListChange(self):
+        """
+        Changing buffer_list between submissions.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(1) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            read_buf_0 = bytearray(1)
+            read_buf_1 = bytearray(2)
+            read_block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[read_buf_0, read_buf_1],
+                offset=0,
+            )
+            io_context.submit([read_block])
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(read_block, 3, 0)],
+            )
+            self.assertEqual(read_buf_0, bytearray(b'b'))
+            self.assertEqual(read_buf_1, bytearray(b'la'))
+            read_buf_2 = bytearray(3)
+            read_block.buffer_list = [read_buf_2]
+            io_context.submit([read_block])
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(read_block, 3, 0)],
+            )
+            self.assertEqual(read_buf_2, bytearray(b'bla'))
+
+    def testBlockPool(self):
+        """
+        Pooled blocks are recycled once completed.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(1) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            pool = libaio.AIOBlockPool(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_size=2,
+            )
+            read_list = []
+            onCompletion = lambda block, res, res2: read_list.append(
+                block.buffer_list[0][:res],
+            )
+            read_block = pool.acquire(offset=0, onCompletion=onCompletion)
+            io_context.submit([read_block])
+            io_context.getEvents(min_nr=None)
+            self.assertIs(
+                pool.acquire(offset=2, onCompletion=onCompletion),
+                read_block,
+            )
+            self.assertEqual(read_block.offset, 2)
+            io_context.submit([read_block])
+            io_context.getEvents(min_nr=None)
+            self.assertEqual(read_list, [b'bl', b'ah'])
+            del read_list[:]
+
+            arena_pool = libaio.AIOBlockPool(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_size=2,
+                block_count=2,
+            )
+            read_block_list = [
+                arena_pool.acquire(offset=offset, onCompletion=onCompletion)
+                for offset in (0, 2)
+            ]
+            self.assertRaises(IndexError, arena_pool.acquire, offset=0)
+            for read_block in read_block_list:
+                io_context.submit([read_block])
+                io_context.getEvents(min_nr=None)
+            self.assertEqual(read_list, [b'bl', b'ah'])
+            arena_pool.acquire(offset=0)
+
+    def testDrainCompletions(self):
+        """
+        Fetching completions signalled by an eventfd.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(
+            2,
+        ) as io_context, libaio.EventFD(
+            flags=libaio.EFD_NONBLOCK,
+        ) as eventfd:
+            temp.write(b'blah')
+            temp.flush()
+            read_block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(2)],
+                    offset=offset,
+                    eventfd=eventfd,
+                )
+                for offset in (0, 2)
+            ]
+            self.assertIs(read_block_list[0].eventfd, eventfd)
+            self.assertEqual(io_context.drainCompletions(eventfd), [])
+            io_context.submit(read_block_list)
+            event_list = []
+            while len(event_list) < 2:
+                select.select([eventfd], [], [])
+                event_list.extend(io_context.drainCompletions(eventfd, nr=1))
+            self.assertEqual(
+                sorted(event_list, key=lambda x: x[0].offset),
+                [(read_block_list[0], 2, 0), (read_block_list[1], 2, 0)],
+            )
+
+    def testCompletionRingWrap(self):
+        """
+        Fetching more completions than the kernel ring can hold at once.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(2) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            read_block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(2)],
+                    offset=offset,
+                )
+                for offset in (0, 2)
+            ]
+            for _ in range(1000):
+                io_context.submit(read_block_list)
+                event_list = []
+                while len(event_list) < 2:
+                    event_list.extend(io_context.getEvents(min_nr=None))
+                self.assertEqual(
+                    sorted(event_list, key=lambda x: x[0].offset),
+                    [(read_block_list[0], 2, 0), (read_block_list[1], 2, 0)],
+                )
+            self.assertEqual(
+                [bytes(x.buffer_list[0]) for x in read_block_list],
+                [b'bl', b'ah'],
+            )
+
+    def testRun(self):
+        """
+        Keeping a number of blocks in flight.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(8) as io_context:
+            data = bytes(range(256)) * 8
+            temp.write(data)
+            temp.flush()
+            result = bytearray(len(data))
+            in_flight_list = []
+            def onCompletion(block, res, res2):
+                """
+                Check and collect completed read.
+                """
+                self.assertEqual((res, res2), (2, 0))
+                result[block.offset:block.offset + 2] = block.buffer_list[0]
+                in_flight_list.remove(block)
+            def iterBlocks():
+                """
+                Produce one read block per 2 bytes.
+                """
+                for offset in range(0, len(data), 2):
+                    block = libaio.AIOBlock(
+                        mode=libaio.AIOBLOCK_MODE_READ,
+                        target_file=temp,
+                        buffer_list=[bytearray(2)],
+                        offset=offset,
+                        onCompletion=onCompletion,
+                    )
+                    in_flight_list.append(block)
+                    self.assertLessEqual(len(in_flight_list), 4)
+                    yield block
+            self.assertEqual(
+                io_context.run(iterBlocks(), depth=4),
+                len(data) // 2,
+            )
+            self.assertEqual(bytes(result), data)
+            self.assertEqual(in_flight_list, [])
+
+    def testGetEventsInto(self):
+        """
+        Storing completion events into an array.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(2) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            completion_event_list = []
+            block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(length)],
+                    offset=0,
+                    onCompletion=lambda block, res, res2: (
+                        completion_event_list.append((block, res, res2))
+                    ),
+                )
+                for length in (1, 2)
+            ]
+            block_dict = {id(x): x for x in block_list}
+            io_context.submit(block_list)
+            event_array = (ctypes.c_int64 * 3 * 2)()
+            event_count = 0
+            while event_count < 2:
+                event_count += io_context.getEventsInto(
+                    (ctypes.c_int64 * 3 * (2 - event_count)).from_buffer(
+                        event_array,
+                        event_count * 3 * 8,
+                    ),
+                )
+            self.assertEqual(
+                sorted(
+                    (
+                        (block_dict[block_id], res, res2)
+                        for block_id, res, res2 in event_array
+                    ),
+                    key=lambda x: x[1],
+                ),
+                [(block_list[0], 1, 0), (block_list[1], 2, 0)],
+            )
+            self.assertEqual(completion_event_list, [])
+            self.assertEqual(io_context.getEvents(timeout=0), [])
+
+    def testPerFileLimit(self):
+        """
+        Blocks above the per-file limit are held back until others complete.
+        """
+        self.assertRaises(ValueError, self.context_class, 1, per_file_limit=0)
+        with tempfile.TemporaryFile() as temp, self.context_class(
+            4,
+            per_file_limit=2,
+        ) as io_context:
+            temp.write(b'blahblah')
+            temp.flush()
+            block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(2)],
+                    offset=offset,
+                )
+                for offset in range(0, 8, 2)
+            ]
+            self.assertEqual(io_context.submit(block_list), 4)
+            event_list = io_context.getEvents(min_nr=None)
+            self.assertEqual(len(event_list), 2)
+            event_list += io_context.getEvents(min_nr=None)
+            self.assertEqual(
+                sorted(event_list, key=lambda x: x[0].offset),
+                [(x, 2, 0) for x in block_list],
+            )
+
+    def testThreadedSubmit(self):
+        """
+        Submitting from one thread while another one gets events.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(8) as io_context:
+            temp.write(bytes(range(256)))
+            temp.flush()
+            # Do not overflow the context.
+            in_flight_semaphore = threading.Semaphore(8)
+            block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(1)],
+                    offset=offset,
+                    onCompletion=lambda block, res, res2: (
+                        in_flight_semaphore.release()
+                    ),
+                )
+                for offset in range(256)
+            ]
+            def submit():
+                """
+                Submit blocks one at a time.
+                """
+                for block in block_list:
+                    in_flight_semaphore.acquire()
+                    self.assertEqual(io_context.submit([block]), 1)
+            submit_thread = threading.Thread(target=submit)
+            submit_thread.start()
+            try:
+                event_list = []
+                while len(event_list) < len(block_list):
+                    new_event_list = io_context.getEvents(timeout=5)
+                    self.assertTrue(new_event_list)
+                    event_list.extend(new_event_list)
+            finally:
+                submit_thread.join()
+            self.assertEqual(
+                sorted(event_list, key=lambda x: x[0].offset),
+                [(x, 1, 0) for x in block_list],
+            )
+            self.assertEqual(
+                [x.buffer_list[0][0] for x in block_list],
+                list(range(256)),
+            )
+
+    def testRunPerFileLimit(self):
+        """
+        Keeping blocks in flight with a per-file limit, when the kernel only
+        accepts part of the submitted blocks.
+        """
+        io_submit_raw = libaio.libaio.io_submit_raw
+        def submitOne(ctx, nr, iocb_pp):
+            """
+            Only let one block in per io_submit call.
+            """
+            return io_submit_raw(ctx, min(nr, 1), iocb_pp)
+        with tempfile.TemporaryFile() as temp0, tempfile.TemporaryFile(
+        ) as temp1, self.context_class(
+            4,
+            per_file_limit=1,
+        ) as io_context, mock.patch.object(
+            libaio.libaio,
+            'io_submit_raw',
+            submitOne,
+        ):
+            for temp in (temp0, temp1):
+                temp.write(b'blahblah')
+                temp.flush()
+            completed_list = []
+            block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=(temp0, temp1)[index % 2],
+                    buffer_list=[bytearray(1)],
+                    offset=index,
+                    onCompletion=lambda block, res, res2: (
+                        completed_list.append(block.offset)
+                    ),
+                )
+                for index in range(8)
+            ]
+            self.assertEqual(io_context.run(block_list, depth=4), 8)
+            self.assertEqual(sorted(completed_list), list(range(8)))
+
+    def testSubmitRaw(self):
+        """
+        Submitting a group of blocks through a reused iocb pointer array.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(2) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            read_block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(2)],
+                    offset=offset,
+                )
+                for offset in (0, 2)
+            ]
+            submit_array = io_context.getSubmitArray(read_block_list)
+            self.assertRaises(
+                ValueError,
+                io_context.submitRaw,
+                read_block_list + read_block_list,
+                submit_array,
+            )
+            for _ in range(2):
+                self.assertEqual(
+                    io_context.submitRaw(read_block_list, submit_array),
+                    2,
+                )
+                self.assertEqual(
+                    sorted(
+                        io_context.getEvents(min_nr=None),
+                        key=lambda x: x[0].offset,
+                    ),
+                    [(read_block_list[0], 2, 0), (read_block_list[1], 2, 0)],
+                )
+
+    def testDeferredSubmit(self):
+        """
+        Deferred blocks are submitted in batches.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(
+            2,
+            submit_batch=2,
+        ) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            read_buf_0 = bytearray(2)
+            read_buf_1 = bytearray(2)
+            read_block_0 = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[read_buf_0],
+                offset=0,
+            )
+            read_block_1 = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[read_buf_1],
+                offset=2,
+            )
+            # Batch is not full: block is only queued
+            self.assertEqual(io_context.submit([read_block_0], defer=True), 1)
+            # Deferred blocks are still detected as already submitted
+            self.assertRaises(
+                ValueError,
+                io_context.submit,
+                [read_block_0],
+                defer=True,
+            )
+            # Batch is full: both blocks are submitted at once
+            self.assertEqual(io_context.submit([read_block_1], defer=True), 2)
+            self.assertEqual(io_context.flush(), 0)
+            self.assertEqual(
+                sorted(
+                    io_context.getEvents(min_nr=None),
+                    key=lambda x: x[0].offset,
+                ),
+                [(read_block_0, 2, 0), (read_block_1, 2, 0)],
+            )
+            self.assertEqual(read_buf_0, bytearray(b'bl'))
+            self.assertEqual(read_buf_1, bytearray(b'ah'))
+            self.assertEqual(io_context.submit([read_block_0], defer=True), 1)
+            self.assertEqual(io_context.flush(), 1)
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(read_block_0, 2, 0)],
+            )
+            # getEvents submits deferred blocks before waiting for them
+            self.assertEqual(io_context.submit([read_block_1], defer=True), 1)
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(read_block_1, 2, 0)],
+            )
+            # and so does processEvents
+            completion_event_list = []
+            read_block_0.onCompletion = lambda block, res, res2: (
+                completion_event_list.append((block, res, res2))
+            )
+            self.assertEqual(io_context.submit([read_block_0], defer=True), 1)
+            self.assertEqual(io_context.processEvents(min_nr=None), 1)
+            self.assertEqual(completion_event_list, [(read_block_0, 2, 0)])
+            # Nothing in flight: non-blocking polls return immediately
+            self.assertEqual(io_context.getEvents(timeout=0), [])
+            self.assertEqual(io_context.processEvents(timeout=0), 0)
+
     def testFsync(self):
         """
         FSYNC was introduced in a later kernel version than READ/WRITE.
         (along with FDSYNC)
         """
-        with tempfile.TemporaryFile() as temp, libaio.AIOContext(1) as io_context:
+        with tempfile.TemporaryFile() as temp, self.context_class(1) as io_context:
             completion_event_list = []
             onCompletion = lambda block, res, res2: (
                 completion_event_list.append((block, res, res2))
@@ -178,7 +625,7 @@ class LibAIOTests(unittest.TestCase):
         FDSYNC was introduced in a later kernel version than READ/WRITE.
         (along with FSYNC)
         """
-        with tempfile.TemporaryFile() as temp, libaio.AIOContext(1) as io_context:
+        with tempfile.TemporaryFile() as temp, self.context_class(1) as io_context:
             completion_event_list = []
             onCompletion = lambda block, res, res2: (
                 completion_event_list.append((block, res, res2))
@@ -208,7 +655,7 @@ class LibAIOTests(unittest.TestCase):
         """
         POLL was introduced in a later kernel version than FSYNC/FDSYNC.
         """
-        with libaio.AIOContext(1) as io_context:
+        with self.context_class(1) as io_context:
             completion_event_list = []
             onCompletion = lambda block, res, res2: (
                 completion_event_list.append((block, res, res2))
@@ -233,7 +680,7 @@ class LibAIOTests(unittest.TestCase):
                 os.write(write_end, b'foo')
                 poll_event_list_reference = [(
                     poll_block,
-                    select.EPOLLIN | select.EPOLLRDNORM,
+                    self.poll_readable_events,
                     0,
                 )]
                 self.assertEqual(
@@ -248,6 +695,266 @@ class LibAIOTests(unittest.TestCase):
                 os.close(write_end)
                 os.close(read_end)
 
+    def testCancelAll(self):
+        """
+        Cancelling all in-flight blocks.
+        """
+        with self.context_class(1) as io_context:
+            read_end, write_end = os.pipe()
+            try:
+                poll_block = libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_POLL,
+                    target_file=read_end,
+                    event_mask=select.EPOLLIN,
+                )
+                try:
+                    io_context.submit([poll_block])
+                except OSError as exc:
+                    if exc.errno != errno.EINVAL:
+                        raise
+                    raise unittest.SkipTest('POLL kernel support missing')
+                cancel_list = io_context.cancelAll()
+                self.assertEqual(len(cancel_list), 1)
+                if cancel_list[0] is None:
+                    # Kernel will produce the completion event later.
+                    cancel_list = io_context.getEvents(min_nr=None)
+                self.assertEqual(
+                    [x[0] for x in cancel_list],
+                    [poll_block],
+                )
+            finally:
+                os.close(write_end)
+                os.close(read_end)
+
+class IOUringTests(LibAIOTests):
+    """
+    Testing io_uring, with the same blocks.
+    """
+    context_class = libaio.IOUringContext
+    # io_uring only reports polled events.
+    poll_readable_events = select.EPOLLIN
+
+    def setUp(self):
+        try:
+            libaio.IOUringContext(1).close()
+        except NotImplementedError:
+            raise unittest.SkipTest('io_uring not supported') from None
+        except OSError as exc:
+            if exc.errno not in (errno.ENOSYS, errno.EPERM):
+                raise
+            raise unittest.SkipTest('io_uring support missing or disabled')
+
+    def testDrainCompletions(self):
+        """
+        Per-block eventfd is not available with io_uring.
+        """
+        raise unittest.SkipTest('AIOBlock.eventfd not supported')
+
+    def testContextEventFD(self):
+        """
+        Completions signalled by an eventfd registered on the context.
+        """
+        with tempfile.TemporaryFile() as temp, libaio.EventFD(
+            flags=libaio.EFD_NONBLOCK,
+        ) as eventfd, self.context_class(
+            2,
+            eventfd=eventfd,
+        ) as io_context:
+            temp.write(b'blah')
+            temp.flush()
+            read_block_list = [
+                libaio.AIOBlock(
+                    mode=libaio.AIOBLOCK_MODE_READ,
+                    target_file=temp,
+                    buffer_list=[bytearray(2)],
+                    offset=offset,
+                )
+                for offset in (0, 2)
+            ]
+            io_context.submit(read_block_list)
+            event_list = []
+            while len(event_list) < 2:
+                select.select([eventfd], [], [])
+                self.assertTrue(eventfd.read())
+                event_list.extend(io_context.getEvents(timeout=0))
+            self.assertEqual(
+                sorted(event_list, key=lambda x: x[0].offset),
+                [(read_block_list[0], 2, 0), (read_block_list[1], 2, 0)],
+            )
+
+    def testNegativeOffset(self):
+        """
+        Invalid offsets are reported by the kernel in the completion event.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(
+            1,
+        ) as io_context:
+            block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[bytearray(4)],
+                # -1 means the current file position to io_uring.
+                offset=-2,
+            )
+            self.assertEqual(block.offset, -2)
+            io_context.submit([block])
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(block, -errno.EINVAL, 0)],
+            )
+
+    @staticmethod
+    def _getLastSQE(io_context):
+        """
+        Return a copy of the last submission queue entry written by
+        io_context.
+        """
+        # pylint: disable=protected-access
+        return libaio.io_uring.io_uring_sqe.from_buffer_copy(
+            io_context._sqe_map,
+            ((io_context._sq_tail.value - 1) & io_context._sq_mask) *
+            ctypes.sizeof(libaio.io_uring.io_uring_sqe),
+        )
+        # pylint: enable=protected-access
+
+    def testRegistered(self):
+        """
+        Reading and writing registered files and buffers.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(
+            2,
+        ) as io_context:
+            arena = mmap(-1, 4)
+            io_context.registerFiles([temp])
+            io_context.registerBuffers([bytearray(1), arena])
+            arena[:] = b'blah'
+            arena_view = memoryview(arena)
+            write_block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_WRITE,
+                target_file=temp,
+                buffer_list=[arena_view[1:3]],
+                offset=0,
+            )
+            io_context.submit([write_block])
+            sqe = self._getLastSQE(io_context)
+            self.assertEqual(sqe.opcode, libaio.io_uring.IORING_OP_WRITE_FIXED)
+            self.assertTrue(sqe.flags & libaio.io_uring.IOSQE_FIXED_FILE)
+            self.assertEqual(sqe.fd, 0)
+            self.assertEqual(sqe.buf_index, 1)
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(write_block, 2, 0)],
+            )
+            temp.seek(0)
+            self.assertEqual(temp.read(), b'la')
+            read_block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[arena_view[2:4]],
+                offset=0,
+            )
+            io_context.submit([read_block])
+            sqe = self._getLastSQE(io_context)
+            self.assertEqual(sqe.opcode, libaio.io_uring.IORING_OP_READ_FIXED)
+            self.assertTrue(sqe.flags & libaio.io_uring.IOSQE_FIXED_FILE)
+            self.assertEqual(sqe.buf_index, 1)
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(read_block, 2, 0)],
+            )
+            self.assertEqual(bytes(arena), b'blla')
+            # Not in a registered buffer: read without it.
+            unregistered_block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[bytearray(2)],
+                offset=0,
+            )
+            io_context.submit([unregistered_block])
+            sqe = self._getLastSQE(io_context)
+            self.assertEqual(sqe.opcode, libaio.io_uring.IORING_OP_READ)
+            self.assertTrue(sqe.flags & libaio.io_uring.IOSQE_FIXED_FILE)
+            self.assertEqual(sqe.buf_index, 0)
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(unregistered_block, 2, 0)],
+            )
+            self.assertEqual(unregistered_block.buffer_list[0], b'la')
+            io_context.unregisterBuffers()
+            io_context.unregisterFiles()
+            del arena_view, write_block, read_block, unregistered_block
+
+    def testIOPoll(self):
+        """
+        Polled context only accepts reads and writes, on O_DIRECT files.
+        """
+        with tempfile.TemporaryFile() as temp, self.context_class(
+            1,
+            iopoll=True,
+        ) as io_context:
+            fsync_block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_FSYNC,
+                target_file=temp,
+            )
+            self.assertRaises(ValueError, io_context.submit, [fsync_block])
+            self.assertEqual(io_context.getEvents(timeout=0), [])
+            read_block = libaio.AIOBlock(
+                mode=libaio.AIOBLOCK_MODE_READ,
+                target_file=temp,
+                buffer_list=[bytearray(4)],
+                offset=0,
+            )
+            io_context.submit([read_block])
+            self.assertEqual(
+                io_context.getEvents(min_nr=None),
+                [(read_block, -errno.EOPNOTSUPP, 0)],
+            )
+
+class IOUringSQPollTests(IOUringTests):
+    """
+    Testing io_uring with a kernel submission thread.
+    """
+    context_class = functools.partial(
+        libaio.IOUringContext,
+        sqpoll_idle=10,
+    )
+
+    def setUp(self):
+        super().setUp()
+        try:
+            self.context_class(1).close()
+        except NotImplementedError:
+            raise unittest.SkipTest('sqpoll not supported') from None
+
+class ContextClassTests(unittest.TestCase):
+    """
+    Testing backend selection.
+    """
+    def testEnvironment(self):
+        """
+        Context follows LIBAIO_BACKEND.
+        """
+        for value, context_class in (
+            (None, libaio.AIOContext),
+            ('', libaio.AIOContext),
+            ('aio', libaio.AIOContext),
+            ('io_uring', libaio.IOUringContext),
+        ):
+            with mock.patch.dict(os.environ):
+                os.environ.pop('LIBAIO_BACKEND', None)
+                if value is not None:
+                    os.environ['LIBAIO_BACKEND'] = value
+                self.assertIs(libaio.Context, context_class)
+                self.assertIs(libaio.getContextClass(), context_class)
+        with mock.patch.dict(os.environ, LIBAIO_BACKEND='foo'):
+            self.assertRaises(ValueError, getattr, libaio, 'Context')
+            # Explicit names do not depend on the environment.
+            self.assertIs(
+                libaio.getContextClass('io_uring'),
+                libaio.IOUringContext,
+            )
+        self.assertRaises(ValueError, libaio.getContextClass, 'foo')
+        self.assertRaises(AttributeError, getattr, libaio, 'foo')
 
 if __name__ == '__main__':
     unittest.main()